@@ -1,69 +1,82 @@
-from langchain.agents import initialize_agent, AgentType, Tool
-from langchain.chains import LLMMathChain
-from langchain.chat_models import ChatOpenAI
-from langchain.llms import OpenAI
-from langchain.utilities import SerpAPIWrapper, SQLDatabase
-from langchain_experimental.sql import SQLDatabaseChain
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.tools.render import format_tool_to_openai_function
-from langchain.agents.format_scratchpad import format_to_openai_functions
-from langchain.agents.output_parsers import OpenAIFunctionsAgentOutputParser
-from langchain.agents import AgentExecutor
+from functools import lru_cache
 
-llm = ChatOpenAI(temperature=0, model="gpt-3.5-turbo-0613")
-search = SerpAPIWrapper()
-llm_math_chain = LLMMathChain.from_llm(llm=llm, verbose=True)
-db = SQLDatabase.from_uri("sqlite:///instance/application_billing.db")
-db_chain = SQLDatabaseChain.from_llm(llm, db, verbose=True)
-tools = [
-    # Tool(
-    #     name="Search",
-    #     func=search.run,
-    #     description="useful for when you need to answer questions about current events. You should ask targeted questions",
-    # ),
-    Tool(
-        name="Calculator",
-        func=llm_math_chain.run,
-        description="useful for when you need to answer questions about math",
-    ),
-    Tool(
-        name="app_cost-DB",
-        func=db_chain.run,
-        description="""
-        useful for when you need to answer questions about application costs. 
-        Input should be in the form of a question containing full context 
-        to get usage and cost for an application use SELECT id, app_name, component, usage, unit, effective_cost FROM billing_data;
-        to know the effective cost per unit of a component usage for an app, use SELECT id, component, unit, unit_price FROM rate_card;
-        """,
-    ),
-]
+from intent_router import IntentRouter
+from sql_tool import CostQueryTool
 
-prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system", "You are a helpful assistant"),
-        ("user", "{input}"),
-        MessagesPlaceholder(variable_name="agent_scratchpad"),
+# LangChain, the OpenAI client and the SQL chain are imported and built on the first question
+# the router cannot answer itself, so importing the router needs neither LangChain nor API keys
+@lru_cache(maxsize=None)
+def get_agent_executor():
+    from langchain.agents import initialize_agent, AgentType, Tool
+    from langchain.chains import LLMMathChain, create_sql_query_chain
+    from langchain.chat_models import ChatOpenAI
+    from langchain.llms import OpenAI
+    from langchain.utilities import SerpAPIWrapper, SQLDatabase
+    from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain.tools.render import format_tool_to_openai_function
+    from langchain.agents.format_scratchpad import format_to_openai_functions
+    from langchain.agents.output_parsers import OpenAIFunctionsAgentOutputParser
+    from langchain.agents import AgentExecutor
+
+    llm = ChatOpenAI(temperature=0, model="gpt-3.5-turbo-0613")
+    search = SerpAPIWrapper()
+    llm_math_chain = LLMMathChain.from_llm(llm=llm, verbose=True)
+    # read-only access to the API's own database; generated SQL is cached as templates and guarded
+    cost_query = CostQueryTool(generate_sql=lambda question: sql_query_chain.invoke({"question": question}))
+    db = SQLDatabase(cost_query.engine, include_tables=["rate_card", "billing_data"], sample_rows_in_table_info=2)
+    sql_query_chain = create_sql_query_chain(llm, db)
+    tools = [
+        # Tool(
+        #     name="Search",
+        #     func=search.run,
+        #     description="useful for when you need to answer questions about current events. You should ask targeted questions",
+        # ),
+        Tool(
+            name="Calculator",
+            func=llm_math_chain.run,
+            description="useful for when you need to answer questions about math",
+        ),
+        Tool(
+            name="app_cost-DB",
+            func=cost_query.run,
+            description="""
+            useful for when you need to answer questions about application costs. 
+            Input should be in the form of a question containing full context 
+            usage and cost per resource are in billing_data(charge_id, sku_id, service_offering, billing_period_start, billing_period_end, resource_name, resource_type, usage_unit, usage_quantity, effective_cost);
+            an application's resources are named after it, e.g. app_1_vm_1 and app_1_logs belong to app_1, select them with resource_name LIKE 'app_1_%';
+            prices are in rate_card(sku_id, service_category, service_name, service_offering, offering_unit, pricing_unit, pricing_quantity, unit_price), priced per pricing_quantity units;
+            questions should name a resource (or an application's name prefix), resource type, SKU or billing period, queries scanning all of billing_data are rejected
+            """,
+        ),
     ]
-)
 
-llm_with_tools = llm.bind(functions=[format_tool_to_openai_function(t) for t in tools])
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", "You are a helpful assistant"),
+            ("user", "{input}"),
+            MessagesPlaceholder(variable_name="agent_scratchpad"),
+        ]
+    )
 
-agent = (
-    {
-        "input": lambda x: x["input"],
-        "agent_scratchpad": lambda x: format_to_openai_functions(
-            x["intermediate_steps"]
-        ),
-    }
-    | prompt
-    | llm_with_tools
-    | OpenAIFunctionsAgentOutputParser()
-)
+    llm_with_tools = llm.bind(functions=[format_tool_to_openai_function(t) for t in tools])
+
+    agent = (
+        {
+            "input": lambda x: x["input"],
+            "agent_scratchpad": lambda x: format_to_openai_functions(
+                x["intermediate_steps"]
+            ),
+        }
+        | prompt
+        | llm_with_tools
+        | OpenAIFunctionsAgentOutputParser()
+    )
+
+    return AgentExecutor(agent=agent, tools=tools, verbose=True)
 
-agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
+# common cost questions are answered straight from the billing API; the agent only sees the rest
+router = IntentRouter(fallback=lambda question: get_agent_executor().invoke({"input": question})["output"])
 
-agent_executor.invoke(
-    {
-        "input": "what would be the cost of app_1 if compute_cpu usage changed to 7?"
-    }
-)
\ No newline at end of file
+if __name__ == '__main__':
+    print(router.answer("what would be the cost of app_1 if compute_cpu usage changed to 7?"))
+    print(router.report())
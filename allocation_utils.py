@@ -0,0 +1,269 @@
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import numpy as np
+
+from db_utils import db, AllocationRule, AllocationTarget, CostAllocation, BillingData, fetch_tuples, bump_table_version, parse_billing_period
+from rollup_utils import billing_month_expression
+from timeseries_utils import cost_matrix_cache
+
+# Chargeback/showback: each active rule moves the monthly cost of one shared resource (e.g.
+# app_1_logs) onto its consumer resources. Allocation is a single pass; a consumer that is itself
+# the source of another rule passes on only its own direct cost.
+
+ALLOCATION_METHODS = ['fixed', 'proportional', 'even']
+ALLOCATION_DRIVERS = ['effective_cost', 'usage_quantity']
+# allocated costs are rounded to cents; the rounding remainder goes to the largest share so each
+# source's allocations add up to its cost
+COST_DECIMALS = 2
+
+class AllocationError(Exception):
+    pass
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def rule_to_dict(rule, targets):
+    return {
+        'id': rule.id, 'name': rule.name, 'source': rule.source, 'method': rule.method,
+        'driver': rule.driver, 'driver_sku_id': rule.driver_sku_id, 'active': rule.active,
+        'targets': [{'consumer': target.consumer, 'weight': target.weight} for target in targets],
+    }
+
+def rule_targets(rule_ids):
+    targets = defaultdict(list)
+    query = AllocationTarget.query.filter(AllocationTarget.rule_id.in_(rule_ids)).order_by(AllocationTarget.rule_id, AllocationTarget.consumer)
+    for target in query:
+        targets[target.rule_id].append(target)
+    return targets
+
+def list_rules(source=None, active=None):
+    query = AllocationRule.query
+    if source is not None:
+        query = query.filter_by(source=source)
+    if active is not None:
+        query = query.filter_by(active=active)
+    rules = query.order_by(AllocationRule.id).all()
+    targets = rule_targets([rule.id for rule in rules])
+    return [rule_to_dict(rule, targets[rule.id]) for rule in rules]
+
+def parse_targets(method, targets):
+    # [{"consumer": "app_2_vm_1", "weight": 60}, ...] or, except for fixed rules, ["app_2_vm_1", ...]
+    if not isinstance(targets, list) or not targets:
+        raise AllocationError("targets must be a non-empty list")
+    parsed = {}
+    for target in targets:
+        if isinstance(target, str):
+            target = {'consumer': target}
+        if not isinstance(target, dict) or not target.get('consumer'):
+            raise AllocationError("each target needs a consumer")
+        if method == 'fixed' and 'weight' not in target:
+            raise AllocationError(f"fixed rules need a weight for {target['consumer']}")
+        try:
+            weight = float(target.get('weight', 1.0))
+        except (TypeError, ValueError):
+            raise AllocationError(f"weight of {target['consumer']} must be a number")
+        if not weight > 0:
+            raise AllocationError(f"weight of {target['consumer']} must be positive")
+        if target['consumer'] in parsed:
+            raise AllocationError(f"{target['consumer']} is listed twice")
+        parsed[target['consumer']] = weight
+    return parsed
+
+def save_rule(data, rule=None):
+    # Creates (rule=None) or replaces an allocation rule from its JSON form; caller commits
+    source = data.get('source')
+    method = data.get('method')
+    if not source:
+        raise AllocationError("source not provided")
+    if method not in ALLOCATION_METHODS:
+        raise AllocationError(f"unknown method {method}; expected one of {', '.join(ALLOCATION_METHODS)}")
+    driver = data.get('driver', 'effective_cost') if method == 'proportional' else None
+    if method == 'proportional' and driver not in ALLOCATION_DRIVERS:
+        raise AllocationError(f"unknown driver {driver}; expected one of {', '.join(ALLOCATION_DRIVERS)}")
+    targets = parse_targets(method, data.get('targets'))
+    if source in targets:
+        raise AllocationError(f"{source} cannot be its own consumer")
+    active = bool(data.get('active', True))
+    if active:
+        # a second active rule for the same source would allocate its cost twice
+        clash = AllocationRule.query.filter_by(source=source, active=True)
+        if rule is not None:
+            clash = clash.filter(AllocationRule.id != rule.id)
+        if clash.first() is not None:
+            raise AllocationError(f"{source} already has an active allocation rule")
+    now = utcnow()
+    if rule is None:
+        rule = AllocationRule(created_at=now)
+        db.session.add(rule)
+    rule.name = data.get('name') or f'{source} {method}'
+    rule.source = source
+    rule.method = method
+    rule.driver = driver
+    rule.driver_sku_id = data.get('driver_sku_id') if method == 'proportional' else None
+    rule.active = active
+    rule.updated_at = now
+    db.session.flush()
+    AllocationTarget.query.filter_by(rule_id=rule.id).delete()
+    db.session.add_all([AllocationTarget(rule_id=rule.id, consumer=consumer, weight=weight) for consumer, weight in targets.items()])
+    bump_table_version('allocation_rule')
+    return rule
+
+def delete_rule(rule):
+    # Drops the rule and the allocations it produced; caller commits
+    AllocationTarget.query.filter_by(rule_id=rule.id).delete()
+    CostAllocation.query.filter_by(rule_id=rule.id).delete()
+    db.session.delete(rule)
+    bump_table_version('allocation_rule')
+    bump_table_version('cost_allocation')
+
+def month_bounds(months):
+    first = parse_billing_period(months[0] + '01')
+    last = parse_billing_period(months[-1] + '01')
+    after = last.replace(year=last.year + 1, month=1) if last.month == 12 else last.replace(month=last.month + 1)
+    return first, after
+
+def driver_values(driver, sku_id, consumers, months):
+    # consumers x months matrix of a proportional driver. Plain effective_cost is read from the
+    # cached cost matrix; a usage driver or a SKU filter needs one grouped billing_data query.
+    values = np.zeros((len(consumers), len(months)))
+    if driver == 'effective_cost' and sku_id is None:
+        matrix = cost_matrix_cache.get('resource_name')
+        month_pos = {month: j for j, month in enumerate(matrix.months)}
+        columns = np.array([month_pos.get(month, -1) for month in months])
+        rows = np.array([matrix.key_index.get(consumer, -1) for consumer in consumers])
+        found = (rows[:, None] >= 0) & (columns[None, :] >= 0)
+        if matrix.costs.size:
+            values = np.where(found, matrix.costs[np.ix_(rows.clip(0), columns.clip(0))], 0.0)
+        return values
+    column = BillingData.effective_cost if driver == 'effective_cost' else BillingData.usage_quantity
+    month = billing_month_expression(BillingData.billing_period_start)
+    first, after = month_bounds(months)
+    query = db.select(BillingData.resource_name, month, db.func.sum(column)).where(
+        BillingData.billing_period_start >= first, BillingData.billing_period_start < after,
+    )
+    if sku_id is not None:
+        query = query.where(BillingData.sku_id == sku_id)
+    consumer_pos = {consumer: i for i, consumer in enumerate(consumers)}
+    month_pos = {month: j for j, month in enumerate(months)}
+    for name, billing_month, total in fetch_tuples(query.group_by(BillingData.resource_name, month)):
+        i = consumer_pos.get(name)
+        j = month_pos.get(billing_month)
+        if i is not None and j is not None:
+            values[i, j] = total or 0.0
+    return values
+
+def allocation_months(months=None):
+    # The requested YYYYMM months, or every month with charges
+    matrix = cost_matrix_cache.get('resource_name')
+    if not months:
+        return list(matrix.months)
+    for month in months:
+        if len(month) != 6 or not month.isdigit() or not 1 <= int(month[4:]) <= 12:
+            raise AllocationError(f"invalid month {month}; expected YYYYMM")
+    return sorted(set(months))
+
+def compute_allocations(rules, months):
+    # rules: dicts as returned by list_rules. Every (rule, consumer) target is one entry of a
+    # sparse sources x consumers allocation matrix, held as coordinate arrays with a weight
+    # column per month; the source cost vector times that matrix is then a few array operations
+    # however many charges and consumers there are. Returns (rule_index, consumers, amounts):
+    # per target, its rule's position in rules, its consumer and a per-month amount row.
+    n_months = len(months)
+    if not rules or not n_months:
+        return np.zeros(0, dtype=np.int64), [], np.zeros((0, n_months))
+    matrix = cost_matrix_cache.get('resource_name')
+    month_pos = {month: j for j, month in enumerate(matrix.months)}
+    columns = np.array([month_pos.get(month, -1) for month in months])
+    sources = np.array([matrix.key_index.get(rule['source'], -1) for rule in rules])
+    source_costs = np.zeros((len(rules), n_months))
+    if matrix.costs.size:
+        found = (sources[:, None] >= 0) & (columns[None, :] >= 0)
+        source_costs = np.where(found, matrix.costs[np.ix_(sources.clip(0), columns.clip(0))], 0.0)
+    source_costs = np.round(source_costs, COST_DECIMALS)
+
+    sizes = np.array([len(rule['targets']) for rule in rules])
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    rule_index = np.repeat(np.arange(len(rules)), sizes)
+    consumers = [target['consumer'] for rule in rules for target in rule['targets']]
+    # raw shares: fixed weights, 1 for even splits, the driver for proportional rules
+    raw = np.repeat(np.array([target['weight'] if rule['method'] == 'fixed' else 1.0
+                              for rule in rules for target in rule['targets']])[:, None], n_months, axis=1)
+    proportional = defaultdict(list)
+    for position, rule in enumerate(rules):
+        if rule['method'] == 'proportional':
+            proportional[(rule['driver'], rule['driver_sku_id'])].append(position)
+    for (driver, sku_id), positions in proportional.items():
+        targets = np.concatenate([np.arange(starts[p], starts[p] + sizes[p]) for p in positions])
+        names = sorted({consumers[t] for t in targets})
+        name_pos = {name: i for i, name in enumerate(names)}
+        values = driver_values(driver, sku_id, names, months)
+        raw[targets] = np.maximum(values[[name_pos[consumers[t]] for t in targets]], 0.0)
+    totals = np.add.reduceat(raw, starts, axis=0)
+    # a proportional rule whose consumers show no usage in a month splits that month evenly
+    idle = totals[rule_index] == 0
+    raw[idle] = 1.0
+    totals = np.add.reduceat(raw, starts, axis=0)
+
+    amounts = np.round(source_costs[rule_index] * raw / totals[rule_index], COST_DECIMALS)
+    remainder = source_costs - np.add.reduceat(amounts, starts, axis=0)
+    largest = np.maximum.reduceat(np.abs(amounts), starts, axis=0)
+    candidates = np.where(np.abs(amounts) == largest[rule_index], np.arange(len(consumers))[:, None], len(consumers))
+    first = np.minimum.reduceat(candidates, starts, axis=0)
+    np.add.at(amounts, (first, np.broadcast_to(np.arange(n_months), first.shape)), remainder)
+    return rule_index, consumers, np.round(amounts, COST_DECIMALS)
+
+def run_allocations(months=None):
+    # Recomputes and persists the allocations of the given months (default all) from the active
+    # rules, replacing what was stored for those months in one transaction
+    full = not months
+    months = allocation_months(months)
+    rules = list_rules(active=True)
+    rule_index, consumers, amounts = compute_allocations(rules, months)
+    targets, columns = np.nonzero(amounts)
+    rows = [
+        {'billing_month': months[j], 'rule_id': rules[rule_index[t]]['id'], 'consumer': consumers[t],
+         'source': rules[rule_index[t]]['source'], 'allocated_cost': float(amounts[t, j])}
+        for t, j in zip(targets.tolist(), columns.tolist())
+    ]
+    # plain Core statements: the ORM's bulk paths cost more than the computation at a million rows
+    # A full run clears the table with an unqualified DELETE, which SQLite truncates instead of
+    # unlinking a million rows from each index
+    connection = db.session.connection()
+    if full:
+        connection.execute(db.delete(CostAllocation.__table__))
+    elif months:
+        connection.execute(db.delete(CostAllocation.__table__).where(CostAllocation.billing_month.in_(months)))
+    if rows:
+        connection.execute(db.insert(CostAllocation.__table__), rows)
+    bump_table_version('cost_allocation')
+    db.session.commit()
+    return {
+        'months': months, 'rules': len(rules), 'allocations': len(rows),
+        'allocated_cost': round(float(amounts.sum()), COST_DECIMALS),
+        'consumers': len(set(consumers)),
+    }
+
+def query_allocations(consumer=None, source=None, rule_id=None, billing_month=None):
+    query = db.select(CostAllocation.billing_month, CostAllocation.rule_id, CostAllocation.source, CostAllocation.consumer, CostAllocation.allocated_cost)
+    for column, value in ((CostAllocation.consumer, consumer), (CostAllocation.source, source), (CostAllocation.rule_id, rule_id), (CostAllocation.billing_month, billing_month)):
+        if value is not None:
+            query = query.where(column == value)
+    query = query.order_by(CostAllocation.billing_month, CostAllocation.source, CostAllocation.consumer)
+    result = db.session.connection().execute(query)
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
+def allocated_totals(resource_name=None):
+    # {resource: [allocated in, allocated out]} over all persisted months
+    totals = defaultdict(lambda: [0.0, 0.0])
+    for position, column in enumerate((CostAllocation.consumer, CostAllocation.source)):
+        query = db.select(column, db.func.sum(CostAllocation.allocated_cost))
+        if resource_name is not None:
+            query = query.where(column == resource_name)
+        for name, total in db.session.connection().execute(query.group_by(column)):
+            totals[name][position] = total
+    return totals
+
+def chargeback(direct, allocated_in, allocated_out):
+    return round(direct + allocated_in - allocated_out, COST_DECIMALS)
@@ -0,0 +1,55 @@
+import numpy as np
+
+# 0.6745 = Phi^-1(0.75): scales the MAD so the robust z-score matches a standard z on normal data
+MAD_SCALE = 0.6745
+# modified z-score above which a change is an outlier (Iglewicz and Hoaglin)
+DEFAULT_THRESHOLD = 3.5
+DEFAULT_TOP = 20
+MAX_TOP = 1000
+# floor of the spread, as a share of the key's median cost, so flat series don't divide by ~0
+MIN_RELATIVE_SPREAD = 0.01
+
+def robust_z_scores(costs):
+    # Month-over-month deltas of every row and their modified z-scores against the row's own
+    # median delta and MAD, all in one pass over the (keys x months) matrix
+    deltas = np.diff(costs, axis=1)
+    median = np.median(deltas, axis=1, keepdims=True)
+    mad = np.median(np.abs(deltas - median), axis=1, keepdims=True)
+    floor = np.maximum(MIN_RELATIVE_SPREAD * np.median(np.abs(costs), axis=1, keepdims=True), MIN_RELATIVE_SPREAD)
+    z = MAD_SCALE * (deltas - median) / np.maximum(mad, floor)
+    return deltas, z
+
+def detect_anomalies(matrix, top=DEFAULT_TOP, month=None, threshold=DEFAULT_THRESHOLD, min_delta=0.0):
+    # Top changes by |z| of a CostMatrix, optionally only those into one month ('YYYYMM')
+    if len(matrix.months) < 3:
+        return []
+    deltas, z = robust_z_scores(matrix.costs)
+    score = np.abs(z)
+    score[(score < threshold) | (np.abs(deltas) < min_delta)] = 0
+    if month is not None:
+        if month not in matrix.months[1:]:
+            raise ValueError(f"no month-over-month change for {month}; data covers {matrix.months[0]} to {matrix.months[-1]}")
+        keep = matrix.months.index(month) - 1
+        score[:, :keep] = 0
+        score[:, keep + 1:] = 0
+    flat = score.ravel()
+    top = min(top, np.count_nonzero(flat))
+    if not top:
+        return []
+    # partial sort: only the top-K cells are ordered
+    candidates = np.argpartition(flat, -top)[-top:]
+    candidates = candidates[np.argsort(flat[candidates])[::-1]]
+    rows, columns = np.unravel_index(candidates, deltas.shape)
+    anomalies = []
+    for i, j in zip(rows.tolist(), columns.tolist()):
+        previous, current = matrix.costs[i, j], matrix.costs[i, j + 1]
+        anomalies.append({
+            matrix.dimension: matrix.keys[i],
+            'billing_month': matrix.months[j + 1],
+            'previous_cost': float(previous),
+            'effective_cost': float(current),
+            'delta': float(deltas[i, j]),
+            'pct_change': float(deltas[i, j] / previous * 100) if previous else None,
+            'z_score': round(float(z[i, j]), 3),
+        })
+    return anomalies
@@ -0,0 +1,668 @@
+import json
+import os
+import shutil
+import uuid
+
+import click
+from flask import Blueprint, current_app, jsonify, request, url_for
+from db_utils import db, create_schema, seed_db, RateCard, BillingData, Job, AllocationRule, to_dict, bump_table_version, get_table_version, explain_query_plan, parse_billing_period
+from http_utils import is_not_modified, not_modified, set_validators
+from estimate_utils import parse_group_by, parse_filters, aggregate_query, aggregate_costs, total_cost
+from pricing_utils import PricingError
+from cache_utils import rate_card_cache
+from query_utils import BILLING_DATA_FIELDS, parse_fields, billing_data_select, billing_data_page_query, billing_data_page, billing_data_charge
+from export_utils import export_response
+from scenario_utils import parse_scenarios, load_charges, price_usage_scenarios
+from rollup_utils import ROLLUP_FIELDS, UNCATEGORIZED, RollupDeltas, rebuild_rollups, ensure_rollups, move_sku_categories, query_rollups
+from rate_history_utils import effective_date, record_rate_card_version, close_rate_card_version, ensure_rate_card_history, add_rate_card_entries
+from timeseries_utils import cost_matrix_cache
+from anomaly_utils import DEFAULT_THRESHOLD, DEFAULT_TOP, MAX_TOP, detect_anomalies
+from forecast_utils import DEFAULT_ALPHA, DEFAULT_BETA, DEFAULT_HISTORY, DEFAULT_LEVEL, forecaster
+from job_utils import init_job_queue, job_queue, job_to_dict
+from allocation_utils import AllocationError, list_rules, rule_targets, rule_to_dict, save_rule, delete_rule, run_allocations, query_allocations, allocated_totals, chargeback
+from reprice_utils import DEFAULT_PARTITION_SIZE, RepriceError, create_run, reprice
+from ingest_utils import DEFAULT_BATCH_SIZE, IngestError, detect_format, iter_records, bulk_upsert_billing_data
+
+# API views and CLI commands, registered on the app by app.create_app
+api = Blueprint('api', __name__, cli_group=None)
+
+def setup_database():
+    create_schema()
+    ensure_rollups()
+    ensure_rate_card_history()
+
+@api.record_once
+def init_app(state):
+    app = state.app
+    app.config.setdefault('BULK_INSERT_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    if app.config.get('SETUP_ON_START', True):
+        with app.app_context():
+            setup_database()
+    init_job_queue(app)
+
+# CRUD operations for rate_card
+@api.route('/api/rate_card', methods=['POST', 'GET', 'PUT', 'DELETE'])
+def manage_rate_card():
+    if request.method == 'POST':
+        data = request.json
+        # if data is an array of objects, iterate through each object and create a new entry in the database for each object
+        # each entry may carry "valid_from" (YYYYMMDD, default today) to backdate its price
+        try:
+            if isinstance(data, list):
+                # ?async=true imports a large list as a background job and answers 202 right away
+                if request.args.get('async', 'false').lower() == 'true':
+                    return job_accepted(job_queue.submit('rate_card_import', {'entries': data}))
+                add_rate_card_entries(data)
+                return jsonify({"message": "Created"}), 201
+            else:
+                new_entry = RateCard(sku_id=data['sku_id'], service_category=data['service_category'], service_name=data['service_name'], service_offering=data['service_offering'], offering_unit=data['offering_unit'], pricing_unit=data['pricing_unit'], pricing_quantity=data['pricing_quantity'], unit_price=data['unit_price'])
+                record_rate_card_version(data, effective_date(data.get('valid_from')))
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({"message": str(e)}), 400
+        db.session.add(new_entry)
+        bump_table_version('rate_card')
+        move_sku_categories({new_entry.sku_id: (UNCATEGORIZED, new_entry.service_category)})
+        db.session.commit()
+        rate_card_cache.rebuild()
+        return jsonify({"message": "Created"}), 201
+    elif request.method == 'GET':
+        sku_id = request.args.get('sku_id')
+        service_offering = request.args.get('service_offering')
+        # reads are served from the in-process rate card cache
+        rate_card = rate_card_cache.snapshot
+        if is_not_modified(rate_card.etag, rate_card.last_modified):
+            return not_modified(rate_card.etag, rate_card.last_modified)
+        if sku_id:
+            entry = rate_card.get(sku_id)
+            if entry:
+                return set_validators(jsonify(entry), rate_card.etag, rate_card.last_modified), 200
+            return jsonify({"message": "Not found"}), 404
+
+        if service_offering:
+            entries = rate_card.filter_by(service_offering)
+            if entries:
+                return set_validators(jsonify(entries), rate_card.etag, rate_card.last_modified), 200
+            return jsonify({"message": "Not found"}), 404
+
+        return set_validators(jsonify(rate_card.entries), rate_card.etag, rate_card.last_modified), 200
+    elif request.method == 'PUT':
+        data = request.json
+        entry = RateCard.query.get(data['sku_id'])
+        if entry:
+            old_category = entry.service_category
+            entry.sku_id = data['sku_id']
+            entry.service_category = data['service_category']
+            entry.service_name = data['service_name']
+            entry.service_offering = data['service_offering']
+            entry.offering_unit = data['offering_unit']
+            entry.pricing_unit = data['pricing_unit']
+            entry.pricing_quantity = data['pricing_quantity']
+            entry.unit_price = data['unit_price']
+            # "valid_from" (YYYYMMDD, default today) backdates the new price
+            try:
+                record_rate_card_version(data, effective_date(data.get('valid_from')))
+            except ValueError as e:
+                db.session.rollback()
+                return jsonify({"message": str(e)}), 400
+            bump_table_version('rate_card')
+            # only a category change moves rollup totals
+            move_sku_categories({entry.sku_id: (old_category, entry.service_category)})
+            db.session.commit()
+            rate_card_cache.rebuild()
+            return jsonify({"message": "Updated"}), 200
+        return jsonify({"message": "Not found"}), 404
+    elif request.method == 'DELETE':
+        data = request.json
+        entry = RateCard.query.get(data['sku_id'])
+        if entry:
+            # "valid_to" (YYYYMMDD, default today) ends the SKU's price history on that day
+            try:
+                close_rate_card_version(entry.sku_id, effective_date(data.get('valid_to')))
+            except ValueError as e:
+                db.session.rollback()
+                return jsonify({"message": str(e)}), 400
+            db.session.delete(entry)
+            bump_table_version('rate_card')
+            move_sku_categories({entry.sku_id: (entry.service_category, UNCATEGORIZED)})
+            db.session.commit()
+            rate_card_cache.rebuild()
+            return jsonify({"message": "Deleted"}), 200
+        return jsonify({"message": "Not found"}), 404
+    return jsonify({"message": "Operation not supported"}), 400
+
+# Effective-dated rate card history
+@api.route('/api/rate_card/history', methods=['GET'])
+def rate_card_history():
+    # sample request: /api/rate_card/history?sku_id=sku001 -> every interval of sku001
+    # sample request: /api/rate_card/history?as_of=20231215 -> the rate card in effect that day
+    # sample response: [{"sku_id": "sku001", "valid_from": "19700101", "valid_to": "20240101", "unit_price": 0.23, ...}]
+    sku_id = request.args.get('sku_id')
+    as_of = request.args.get('as_of')
+    rate_card = rate_card_cache.snapshot
+    if is_not_modified(rate_card.etag, rate_card.last_modified):
+        return not_modified(rate_card.etag, rate_card.last_modified)
+    try:
+        if as_of:
+            entries = [rate_card.history.entry_at(sku_id, as_of)] if sku_id else rate_card.history.entries_at(as_of)
+            entries = [e for e in entries if e]
+        else:
+            entries = [e for e in rate_card.history.entries if not sku_id or e['sku_id'] == sku_id]
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    if not entries:
+        return jsonify({"message": "Not found"}), 404
+    return set_validators(jsonify(entries), rate_card.etag, rate_card.last_modified), 200
+
+# CRUD operations for billing_data
+def check_billing_periods(data):
+    # raises ValueError for a billing_period_start/end the BillingPeriod column could not store
+    for field in ('billing_period_start', 'billing_period_end'):
+        parse_billing_period(data[field])
+
+@api.route('/api/billing_data', methods=['POST', 'GET', 'PUT', 'DELETE'])
+def manage_billing_data():
+    if request.method == 'POST':
+        data = request.json
+        try:
+            check_billing_periods(data)
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        new_entry = BillingData(charge_id=data['charge_id'], sku_id=data['sku_id'], service_offering=data['service_offering'], billing_period_start=data['billing_period_start'], billing_period_end=data['billing_period_end'], resource_name=data['resource_name'], resource_type=data['resource_type'], usage_unit=data['usage_unit'], usage_quantity=data['usage_quantity'], effective_cost=data['effective_cost'])
+        db.session.add(new_entry)
+        deltas = RollupDeltas()
+        deltas.add_charge(to_dict(new_entry, ROLLUP_FIELDS))
+        deltas.apply()
+        bump_table_version('billing_data')
+        db.session.commit()
+        return jsonify({"message": "Created"}), 201
+    elif request.method == 'GET':
+        id = request.args.get('charge_id')
+        resource_name = request.args.get('resource_name')
+
+        # answer repeat polls from the table version before touching the rows
+        version, last_modified = get_table_version('billing_data')
+        etag = f'billing-data-v{version}'
+        if is_not_modified(etag, last_modified):
+            return not_modified(etag, last_modified)
+
+        if id:
+            entry = billing_data_charge(id, BILLING_DATA_FIELDS)
+            if entry:
+                return set_validators(jsonify(entry), etag, last_modified), 200
+            return jsonify({"message": "Not found"}), 404
+
+        # keyset pagination with optional filters and field projection; follow X-Next-Cursor / Link:
+        # unfiltered pages are keyed on charge_id (?after=charge500), filtered ones on billing period
+        # and charge_id, e.g.
+        # ?resource_type=app_vm&period_from=20231201&period_to=20231231&fields=charge_id,usage_quantity&limit=500&after=20231201:charge500
+        limit = request.args.get('limit', current_app.config['BILLING_DATA_PAGE_SIZE'], type=int)
+        limit = max(1, min(limit, current_app.config['BILLING_DATA_MAX_PAGE_SIZE']))
+        after = request.args.get('after')
+        try:
+            fields = parse_fields(request.args.get('fields'), BILLING_DATA_FIELDS)
+            entries, next_cursor = billing_data_page(request.args, fields, limit, after)
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        if resource_name and not entries and not after:
+            return jsonify({"message": "Not found"}), 404
+        response = set_validators(jsonify(entries), etag, last_modified)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+            response.headers['Link'] = f'<{url_for(request.endpoint, **{**request.args.to_dict(), "after": next_cursor})}>; rel="next"'
+        return response, 200
+
+    elif request.method == 'PUT':
+        data = request.json
+        try:
+            check_billing_periods(data)
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        entry = BillingData.query.get(data['charge_id'])
+        if entry:
+            deltas = RollupDeltas()
+            deltas.add_charge(to_dict(entry, ROLLUP_FIELDS), sign=-1)
+            entry.charge_id = data['charge_id']
+            entry.sku_id = data['sku_id']
+            entry.service_offering = data['service_offering']
+            entry.billing_period_start = data['billing_period_start']
+            entry.billing_period_end = data['billing_period_end']
+            entry.resource_name = data['resource_name']
+            entry.resource_type = data['resource_type']
+            entry.usage_unit = data['usage_unit']
+            entry.usage_quantity = data['usage_quantity']
+            deltas.add_charge(to_dict(entry, ROLLUP_FIELDS))
+            deltas.apply()
+            bump_table_version('billing_data')
+            db.session.commit()
+            return jsonify({"message": "Updated"}), 200
+        return jsonify({"message": "Not found"}), 404
+    elif request.method == 'DELETE':
+        data = request.json
+        entry = BillingData.query.get(data['id'])
+        if entry:
+            deltas = RollupDeltas()
+            deltas.add_charge(to_dict(entry, ROLLUP_FIELDS), sign=-1)
+            deltas.apply()
+            db.session.delete(entry)
+            bump_table_version('billing_data')
+            db.session.commit()
+            return jsonify({"message": "Deleted"}), 200
+        return jsonify({"message": "Not found"}), 404
+    return jsonify({"message": "Operation not supported"}), 400
+
+
+# Bulk upsert billing_data from a JSON array, NDJSON or CSV body, streamed in batches
+@api.route('/api/billing_data/bulk', methods=['POST'])
+def bulk_billing_data():
+    # sample request: POST /api/billing_data/bulk?batch_size=10000 with Content-Type: text/csv
+    # sample response: {"rows": 2, "rejected": 0, "rejected_rows": [], "batches": [{"batch": 1, "rows": 2, ...}], ...}
+    # ?async=true spools the body to disk and imports it as a background job (202 + job)
+    batch_size = request.args.get('batch_size', current_app.config['BULK_INSERT_BATCH_SIZE'], type=int)
+    if batch_size < 1:
+        return jsonify({"message": "batch_size must be positive"}), 400
+    try:
+        fmt = detect_format(request.mimetype, request.args.get('format'))
+        if request.args.get('async', 'false').lower() == 'true':
+            upload_dir = os.path.join(current_app.instance_path, 'job_uploads')
+            os.makedirs(upload_dir, exist_ok=True)
+            path = os.path.join(upload_dir, f'{uuid.uuid4().hex}.{fmt}')
+            with open(path, 'wb') as f:
+                shutil.copyfileobj(request.stream, f)
+            return job_accepted(job_queue.submit('billing_data_import', {'path': path, 'format': fmt, 'batch_size': batch_size}))
+        records = iter_records(request.stream, fmt)
+        report = bulk_upsert_billing_data(records, batch_size)
+    except IngestError as e:
+        return jsonify({"message": str(e)}), 400
+    if "error" in report:
+        return jsonify(report), 400
+    return jsonify(report), 201
+
+# Stream billing_data as NDJSON or CSV in constant memory
+@api.route('/api/billing_data/export', methods=['GET'])
+def export_billing_data():
+    # sample request: /api/billing_data/export?format=csv&period_from=20231201&period_to=20231231
+    # accepts the same filters and fields projection as GET /api/billing_data
+    try:
+        fields = parse_fields(request.args.get('fields'), BILLING_DATA_FIELDS + ['effective_cost'])
+        return export_response(billing_data_select(request.args, fields), fields, request.args.get('format', 'ndjson'), 'billing_data')
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+# Calculate resource estimate
+@api.route('/api/calculate_estimate', methods=['POST'])
+def calculate_estimate():
+    # sample payload: {"usage_data": {"sku001": 8, "sku002": 32}}
+    # sample what-if payload: {"scenarios": [{"sku001": 8}, {"sku001": 16, "sku010": 2000000}]}
+    # "as_of": "20231215" prices against the rates in effect on that day
+    data = request.json
+    rate_card = rate_card_cache.snapshot
+    try:
+        engine = rate_card.history.engine_at(data['as_of']) if data.get('as_of') else rate_card.engine
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    try:
+        if 'scenarios' in data:
+            return jsonify({"scenarios": engine.price_scenarios(data['scenarios'])}), 200
+        result = engine.price_scenarios([data['usage_data']])[0]
+    except PricingError as e:
+        return jsonify({"message": str(e)}), 400
+    return jsonify({"estimates": result['estimates']}), 200
+
+# Price what-if usage scenarios for one or more resources against their current charges
+@api.route('/api/scenarios', methods=['POST'])
+def scenarios():
+    # sample payload: {"resource_prefix": "app_1", "scenarios": [{"sku001": 7}, {"name": "more memory", "overrides": {"sku002": 128}}]}
+    # resources are picked by "resource_name", a "resources" list or a "resource_prefix",
+    # optionally narrowed with "period_from"/"period_to"
+    # sample response: {"baseline": {"cost": 3.76, ...}, "scenarios": [{"name": "scenario_1", "cost": 3.53, "delta": -0.23, ...}], ...}
+    data = request.json
+    resources = data.get('resources') or ([data['resource_name']] if data.get('resource_name') else None)
+    resource_prefix = data.get('resource_prefix')
+    if not resources and not resource_prefix:
+        return jsonify({"message": "resource_name, resources or resource_prefix not provided"}), 400
+    try:
+        parsed = parse_scenarios(data.get('scenarios'))
+        charges = load_charges(resources, resource_prefix, {k: data[k] for k in ('period_from', 'period_to') if data.get(k)})
+    except (PricingError, ValueError) as e:
+        return jsonify({"message": str(e)}), 400
+    if not charges[0]:
+        return jsonify({"message": "Not found"}), 404
+    return jsonify(price_usage_scenarios(rate_card_cache.snapshot.engine, *charges, parsed)), 200
+
+# Get cost estimate of a resource
+@api.route('/api/get_resource_estimate', methods=['GET'])
+def resource_estimate():
+    # sample payload {"resource_name": "app_1_vm_1"}
+    # optional breakdown: ?resource_name=app_1_vm_1&group_by=sku_id,billing_period
+    resource_name = request.args.get('resource_name')
+    if resource_name:
+        try:
+            group_by = parse_group_by(request.args.get('group_by'))
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        if group_by:
+            return jsonify({"resource_estimate": total_cost(resource_name=resource_name), "breakdown": aggregate_costs(group_by, resource_name=resource_name)}), 200
+        rollup = query_rollups('resource_name', key=resource_name, by_month=False)
+        estimate = rollup[0]['effective_cost'] if rollup else 0
+        # ?allocations=true adds the shared costs allocated to and away from the resource
+        # sample response: {"resource_estimate": 100, "allocated_in": 12.5, "allocated_out": 0, "chargeback_estimate": 112.5}
+        if request.args.get('allocations', 'false').lower() == 'true':
+            allocated_in, allocated_out = allocated_totals(resource_name)[resource_name]
+            return jsonify({"resource_estimate": estimate, "allocated_in": allocated_in, "allocated_out": allocated_out,
+                            "chargeback_estimate": chargeback(estimate, allocated_in, allocated_out)}), 200
+        return jsonify({"resource_estimate": estimate}), 200
+    return jsonify({"message": "resource name not provided"}), 400
+
+# Get all resources and their estimates
+@api.route('/api/all_resource_estimates', methods=['GET'])
+def all_resource_estimates():
+    # sample response: {"resource_estimates": {"app_1_vm_1": 100, "app_1_vm_1": 200}}
+    # optional rollup: ?group_by=resource_type,billing_period&sku_id=sku001
+    # sample rollup response: [{"resource_type": "app_vm", "billing_period": "20231201", "effective_cost": 790.68}]
+    # ?allocations=true: each resource's cost after shared costs are allocated (chargeback view)
+    group_by = request.args.get('group_by')
+    try:
+        filters = parse_filters(request.args)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    if request.args.get('allocations', 'false').lower() == 'true':
+        if group_by or any(filters.values()):
+            return jsonify({"message": "allocations cannot be combined with group_by or filters"}), 400
+        direct = {row['key']: row['effective_cost'] for row in query_rollups('resource_name', by_month=False)}
+        totals = allocated_totals()
+        resource_estimates = {name: chargeback(direct.get(name, 0.0), *totals[name]) for name in sorted(direct.keys() | totals.keys())}
+        return jsonify(resource_estimates), 200
+    if group_by:
+        try:
+            group_by = parse_group_by(group_by)
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        return jsonify(aggregate_costs(group_by, **filters)), 200
+    if not any(filters.values()):
+        # whole-fleet totals come straight from the pre-summed rollups
+        resource_estimates = {row['key']: row['effective_cost'] for row in query_rollups('resource_name', by_month=False)}
+        return jsonify(resource_estimates), 200
+    rows = aggregate_costs(['resource_name'], **filters)
+    resource_estimates = {row['resource_name']: row['effective_cost'] for row in rows}
+    return jsonify(resource_estimates), 200
+
+# Stream per-resource (or per-group) estimates as NDJSON or CSV
+@api.route('/api/all_resource_estimates/export', methods=['GET'])
+def export_resource_estimates():
+    # sample request: /api/all_resource_estimates/export?format=csv&group_by=resource_name,billing_period
+    try:
+        filters = parse_filters(request.args)
+        group_by = parse_group_by(request.args.get('group_by'), default=['resource_name'])
+        return export_response(aggregate_query(group_by, **filters), group_by + ['effective_cost'], request.args.get('format', 'ndjson'), 'resource_estimates')
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+# Current table versions, for clients that cache responses
+@api.route('/api/versions', methods=['GET'])
+def versions():
+    # sample response: {"rate_card": 3, "billing_data": 17}
+    return jsonify({"rate_card": rate_card_cache.version, "billing_data": get_table_version('billing_data')[0]}), 200
+
+# Pre-summed costs per resource_name, resource_type, sku_id, service_category or billing_month
+@api.route('/api/cost_rollups', methods=['GET'])
+def cost_rollups():
+    # sample request: /api/cost_rollups?dimension=service_category&billing_month=202312
+    # sample response: [{"key": "compute", "billing_month": "202312", "effective_cost": 790.68, "charge_count": 2}]
+    # by_month=false sums each key across months
+    # group=app_1 keeps app_1 and the app_1_* keys; limit=5 returns the 5 costliest rows, costliest first
+    # sample request: /api/cost_rollups?dimension=resource_name&by_month=false&limit=5
+    limit = request.args.get('limit', type=int)
+    try:
+        rows = query_rollups(request.args.get('dimension', 'resource_name'), key=request.args.get('key'), billing_month=request.args.get('billing_month'), by_month=request.args.get('by_month', 'true').lower() != 'false',
+                             group=request.args.get('group'), limit=max(1, min(limit, MAX_TOP)) if limit is not None else None)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    return jsonify(rows), 200
+
+# Month-over-month cost jumps, scored with robust z-scores across every key at once
+@api.route('/api/cost_anomalies', methods=['GET'])
+def cost_anomalies():
+    # sample request: /api/cost_anomalies?dimension=resource_name&month=202312&top=10&min_delta=100
+    # sample response: {"anomalies": [{"resource_name": "app_1_vm_1", "billing_month": "202312", "previous_cost": 790.68,
+    #                   "effective_cost": 2371.02, "delta": 1580.34, "pct_change": 199.87, "z_score": 41.2}], ...}
+    top = max(1, min(request.args.get('top', DEFAULT_TOP, type=int), MAX_TOP))
+    threshold = request.args.get('threshold', DEFAULT_THRESHOLD, type=float)
+    min_delta = request.args.get('min_delta', 0.0, type=float)
+    try:
+        matrix = cost_matrix_cache.get(request.args.get('dimension', 'resource_name'))
+        anomalies = detect_anomalies(matrix, top, request.args.get('month'), threshold, min_delta)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    return jsonify({"anomalies": anomalies, "keys": len(matrix.keys), "months": matrix.months}), 200
+
+# Next-month (or next months) cost forecasts with intervals, fitted for every key at once
+@api.route('/api/forecast', methods=['GET'])
+def forecast():
+    # sample request: /api/forecast?group=app_1 -> app_1 and all app_1_* resources, fitted on their summed cost
+    # sample request: /api/forecast?key=app_1_vm_1&horizon=3&method=holt&level=0.95
+    # sample request: /api/forecast?dimension=service_category -> fleet total plus the top `limit` keys
+    # sample response: {"months": ["202401"], "forecast": [812.4], "lower": [760.1], "upper": [864.7], ...}
+    try:
+        matrix = cost_matrix_cache.get(request.args.get('dimension', 'resource_name'))
+        result = forecaster.forecast(
+            matrix, key=request.args.get('key'), group=request.args.get('group'),
+            method=request.args.get('method', 'linear'),
+            horizon=request.args.get('horizon', 1, type=int),
+            history=request.args.get('history', DEFAULT_HISTORY, type=int),
+            level=request.args.get('level', DEFAULT_LEVEL, type=float),
+            alpha=request.args.get('alpha', DEFAULT_ALPHA, type=float),
+            beta=request.args.get('beta', DEFAULT_BETA, type=float),
+            limit=max(0, min(request.args.get('limit', 20, type=int), MAX_TOP)),
+        )
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    if result is None:
+        return jsonify({"message": "Not found"}), 404
+    return jsonify(result), 200
+
+# Allocation rules for shared resources: fixed split, proportional to a usage driver, or even split
+@api.route('/api/allocation_rules', methods=['POST', 'GET', 'PUT', 'DELETE'])
+def manage_allocation_rules():
+    if request.method == 'GET':
+        # sample request: /api/allocation_rules?source=app_1_logs
+        return jsonify(list_rules(source=request.args.get('source'))), 200
+    data = request.json
+    if request.method == 'POST':
+        # sample payload: {"name": "logs by usage", "source": "app_1_logs", "method": "proportional",
+        #                  "driver": "usage_quantity", "driver_sku_id": "sku004", "targets": ["app_1_vm_1", "app_2_vm_1"]}
+        # sample payload: {"source": "app_1_metrics", "method": "fixed", "targets": [{"consumer": "app_1_vm_1", "weight": 70}, {"consumer": "app_2_vm_1", "weight": 30}]}
+        rule = None
+    else:
+        rule = db.session.get(AllocationRule, data.get('id'))
+        if rule is None:
+            return jsonify({"message": "Not found"}), 404
+    if request.method == 'DELETE':
+        delete_rule(rule)
+        db.session.commit()
+        return jsonify({"message": "Deleted"}), 200
+    # stored allocations follow a new or changed rule once they are recomputed via /api/allocations
+    try:
+        rule = save_rule(data, rule)
+    except AllocationError as e:
+        db.session.rollback()
+        return jsonify({"message": str(e)}), 400
+    db.session.commit()
+    result = rule_to_dict(rule, rule_targets([rule.id])[rule.id])
+    return jsonify(result), 201 if request.method == 'POST' else 200
+
+# Allocated shared costs per month, and their recomputation from the active rules
+@api.route('/api/allocations', methods=['POST', 'GET'])
+def allocations():
+    if request.method == 'POST':
+        # sample payload: {"months": ["202312"]} (default every month with charges); ?async=true runs it as a job
+        months = (request.get_json(silent=True) or {}).get('months')
+        if request.args.get('async', 'false').lower() == 'true':
+            return job_accepted(job_queue.submit('allocate', {'months': months}))
+        try:
+            return jsonify(run_allocations(months)), 200
+        except AllocationError as e:
+            return jsonify({"message": str(e)}), 400
+    # sample request: /api/allocations?consumer=app_1_vm_1&billing_month=202312
+    # sample response: [{"billing_month": "202312", "rule_id": 1, "source": "app_1_logs", "consumer": "app_1_vm_1", "allocated_cost": 12.5}]
+    rows = query_allocations(consumer=request.args.get('consumer'), source=request.args.get('source'),
+                             rule_id=request.args.get('rule_id', type=int), billing_month=request.args.get('billing_month'))
+    return jsonify(rows), 200
+
+def job_accepted(job):
+    response = jsonify(job_to_dict(job))
+    response.status_code = 202
+    response.headers['Location'] = url_for('api.get_job', job_id=job.id)
+    return response
+
+# Background jobs: rollup rebuilds, estimate recomputes, imports and repricing
+@api.route('/api/jobs', methods=['POST', 'GET'])
+def jobs():
+    if request.method == 'POST':
+        # sample payload: {"kind": "reprice", "params": {"by_period": true}}
+        # kinds: rebuild_rollups, resource_estimates, reprice, allocate, rate_card_import, billing_data_import (via /api/billing_data/bulk?async=true)
+        data = request.json
+        if data.get('kind') == 'billing_data_import':
+            return jsonify({"message": "submit imports with POST /api/billing_data/bulk?async=true"}), 400
+        try:
+            job = job_queue.submit(data.get('kind'), data.get('params'))
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        return job_accepted(job)
+    # sample request: /api/jobs?status=running&kind=reprice&limit=20
+    query = Job.query
+    if request.args.get('status'):
+        query = query.filter_by(status=request.args['status'])
+    if request.args.get('kind'):
+        query = query.filter_by(kind=request.args['kind'])
+    limit = max(1, min(request.args.get('limit', 50, type=int), 1000))
+    return jsonify([job_to_dict(job) for job in query.order_by(Job.id.desc()).limit(limit)]), 200
+
+@api.route('/api/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    # poll for status, progress (0 to 1), message and, once finished, result or error
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({"message": "Not found"}), 404
+    return jsonify(job_to_dict(job)), 200
+
+@api.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({"message": "Not found"}), 404
+    if not job.cancel_requested:
+        return jsonify({"message": f"job already {job.status}"}), 409
+    return jsonify(job_to_dict(job)), 202
+
+# Create or upgrade the schema and backfill rollups and rate card history, once per deploy when
+# workers start with GPTBMA_LAZY_SETUP=1: flask --app app init-db
+@api.cli.command('init-db')
+def init_db_command():
+    setup_database()
+    print("database ready")
+
+# Load the sample rate card and charges into a new database: flask --app app seed
+@api.cli.command('seed')
+def seed_command():
+    create_schema()
+    seeded = seed_db()
+    # backfills the rollups of the sample charges and the history of the sample SKUs
+    ensure_rollups()
+    ensure_rate_card_history()
+    print("sample data seeded" if seeded else "rate card and billing data already present, nothing seeded")
+
+# Recompute all cost rollups from billing_data, e.g. after a backfill: flask --app app rebuild-rollups
+@api.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    rebuild_rollups()
+    db.session.commit()
+    print("cost rollups rebuilt")
+
+# Recompute effective_cost from usage and the rate card, in worker processes:
+#   flask --app app reprice --period-from 20231201 --period-to 20231231 --sku-id sku001 --sku-id sku002
+#   flask --app app reprice --rate-card december.json   (entries as returned by GET /api/rate_card)
+#   flask --app app reprice --by-period                   (each charge at the rates of its billing period)
+#   flask --app app reprice --as-of 20231215              (every charge at the rates of one day)
+#   flask --app app reprice --resume 3                    (continue an interrupted run)
+@api.cli.command('reprice')
+@click.option('--period-from', help='first billing_period_start, YYYYMMDD')
+@click.option('--period-to', help='last billing_period_start, YYYYMMDD')
+@click.option('--sku-id', 'sku_ids', multiple=True, help='only reprice these SKUs')
+@click.option('--rate-card', 'rate_card_file', type=click.File(), help='price against this JSON rate card instead of the current one')
+@click.option('--as-of', help='price against the rates in effect on this day, YYYYMMDD')
+@click.option('--by-period', is_flag=True, help='price each charge against the rates in effect at its billing_period_start')
+@click.option('--workers', type=int, default=None, help='worker processes, 0 to price in this process; default one per CPU')
+@click.option('--partition-size', type=int, default=DEFAULT_PARTITION_SIZE, help='charges per partition')
+@click.option('--resume', 'run_id', type=int, help='resume this run id instead of planning a new one')
+def reprice_command(period_from, period_to, sku_ids, rate_card_file, as_of, by_period, workers, partition_size, run_id):
+    def report(progress, seconds):
+        rate = progress['charges_done'] / seconds if seconds else 0
+        remaining = (progress['charges'] - progress['charges_done']) / rate if rate else 0
+        print(f"run {progress['run_id']}: partitions {progress['partitions_done']}/{progress['partitions']}, "
+              f"charges {progress['charges_done']}/{progress['charges']} ({progress['charges_changed']} changed), "
+              f"{rate:.0f} charges/s, eta {remaining:.0f}s")
+
+    try:
+        if run_id is None:
+            rate_card = json.load(rate_card_file) if rate_card_file else None
+            run_id = create_run(period_from, period_to, list(sku_ids), rate_card, partition_size, as_of, by_period).id
+            print(f"planned reprice run {run_id}")
+        result = reprice(run_id, workers, progress=report)
+    except (RepriceError, ValueError) as e:
+        raise SystemExit(str(e))
+    print(f"reprice run {run_id} {result['status']}: {result['charges_changed']} of {result['charges_done']} charges changed, {result['charges_unpriced']} without a rate card price")
+
+# Recompute shared-cost allocations from the active rules: flask --app app allocate --month 202312
+@api.cli.command('allocate')
+@click.option('--month', 'months', multiple=True, help='billing month to allocate, YYYYMM; default every month with charges')
+def allocate_command(months):
+    try:
+        result = run_allocations(list(months))
+    except AllocationError as e:
+        raise SystemExit(str(e))
+    print(f"{result['allocated_cost']} allocated from {result['rules']} rules to {result['consumers']} consumers over {len(result['months'])} months")
+
+# Check that every endpoint query is served by an index, without sorting what it reads: flask --app app explain-queries
+@api.cli.command('explain-queries')
+def explain_queries():
+    # rollups that regroup the rows of one resource or SKU by a second column sort just those
+    # rows; every other temp b-tree (a sorted page, a fleet-wide grouping) fails the check
+    grouped_sorts = {'get_resource_estimate?group_by=sku_id', 'all_resource_estimates?sku_id'}
+    queries = {
+        'get_resource_estimate': aggregate_query(resource_name='app_1_vm_1'),
+        'get_resource_estimate?group_by=sku_id': aggregate_query(['sku_id'], resource_name='app_1_vm_1'),
+        'all_resource_estimates': aggregate_query(['resource_name']),
+        'all_resource_estimates?sku_id': aggregate_query(['resource_name'], sku_id='sku001'),
+        'all_resource_estimates?group_by=resource_type,billing_period': aggregate_query(['resource_type', 'billing_period']),
+        'all_resource_estimates?group_by=billing_period': aggregate_query(['billing_period']),
+        'billing_data?charge_id': BillingData.query.filter_by(charge_id='charge001'),
+        'billing_data': billing_data_page_query({}, BILLING_DATA_FIELDS, 1000, 'charge001'),
+        'billing_data?resource_name': billing_data_page_query({'resource_name': 'app_1_vm_1'}, BILLING_DATA_FIELDS, 1000),
+        'billing_data?sku_id': billing_data_page_query({'sku_id': 'sku001'}, BILLING_DATA_FIELDS, 1000),
+        'billing_data?resource_type': billing_data_page_query({'resource_type': 'app_vm'}, BILLING_DATA_FIELDS, 1000),
+        'billing_data?service_offering': billing_data_page_query({'service_offering': 'cpu'}, BILLING_DATA_FIELDS, 1000),
+        'billing_data?period_from&period_to': billing_data_page_query({'period_from': '20231201', 'period_to': '20231231'}, BILLING_DATA_FIELDS, 1000),
+        'billing_data?resource_type&after': billing_data_page_query({'resource_type': 'app_vm'}, BILLING_DATA_FIELDS, 1000, '20231201:charge001'),
+        'billing_data?resource_type&period_from&period_to': billing_data_page_query({'resource_type': 'app_vm', 'period_from': '20230101', 'period_to': '20231231'}, BILLING_DATA_FIELDS, 1000),
+        'billing_data?resource_type&period_from&period_to&after': billing_data_page_query({'resource_type': 'app_vm', 'period_from': '20230101', 'period_to': '20231231'}, BILLING_DATA_FIELDS, 1000, '20231201:charge001'),
+        'billing_data?period_from&period_to&after': billing_data_page_query({'period_from': '20231201', 'period_to': '20231231'}, BILLING_DATA_FIELDS, 1000, '20231201:charge001'),
+    }
+    unindexed = []
+    unsorted = []
+    for name, query in queries.items():
+        plan = explain_query_plan(query)
+        print(f"{name}:\n    " + "\n    ".join(plan))
+        # a SCAN/SEARCH of billing_data without an index is a full table scan, and a temp b-tree
+        # means every matching row is sorted before the first one is returned
+        if any(line.startswith(('SCAN billing_data', 'SEARCH billing_data')) and 'INDEX' not in line for line in plan):
+            unindexed.append(name)
+        if any('USE TEMP B-TREE' in line and not (name in grouped_sorts and 'GROUP BY' in line) for line in plan):
+            unsorted.append(name)
+    problems = []
+    if unindexed:
+        problems.append(f"full table scan in: {', '.join(unindexed)}")
+    if unsorted:
+        problems.append(f"temp b-tree sort in: {', '.join(unsorted)}")
+    if problems:
+        raise SystemExit('; '.join(problems))
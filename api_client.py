@@ -0,0 +1,120 @@
+import asyncio
+import os
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Shared HTTP client for the LangChain billing tools: one pooled keep-alive session per
+# process for sync calls and one aiohttp session per event loop for async calls
+
+DEFAULT_BASE_URL = 'http://localhost:5000'
+RETRY_STATUSES = (502, 503, 504)
+# methods safe to resend after the request may have reached the server (urllib3's default set)
+IDEMPOTENT_METHODS = Retry.DEFAULT_ALLOWED_METHODS
+
+class BillingApiClient:
+
+    def __init__(self, base_url=None, timeout=10.0, retries=3, backoff_factor=0.2, pool_size=20):
+        self.base_url = (base_url or os.environ.get('GPTBMA_API_URL', DEFAULT_BASE_URL)).rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.pool_size = pool_size
+        self._session = None
+        self._async_session = None
+        self._async_loop = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            # connect errors are retried for every method, read errors and 5xx only for idempotent ones
+            retry = Retry(total=self.retries, connect=self.retries, read=self.retries, status=self.retries,
+                          backoff_factor=self.backoff_factor, status_forcelist=RETRY_STATUSES,
+                          allowed_methods=IDEMPOTENT_METHODS)
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retry)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._session = session
+        return self._session
+
+    def request(self, method, path, **kwargs):
+        response = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+        return response.json()
+
+    def get(self, path, params=None):
+        return self.request('GET', path, params=params)
+
+    def post(self, path, json=None):
+        return self.request('POST', path, json=json)
+
+    def async_session(self):
+        # aiohttp sessions are bound to the loop that created them
+        loop = asyncio.get_running_loop()
+        if self._async_session is None or self._async_session.closed or self._async_loop is not loop:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=30)
+            self._async_session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._async_loop = loop
+        return self._async_session
+
+    async def arequest(self, method, path, **kwargs):
+        # same policy as the sync session: a failed connect never sent the request and is retried
+        # for every method; a dropped connection, a timeout or a 5xx only for idempotent methods
+        session = self.async_session()
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            try:
+                async with session.request(method, self.base_url + path, **kwargs) as response:
+                    if response.status in RETRY_STATUSES and idempotent and not last_attempt:
+                        await asyncio.sleep(self.backoff_factor * 2 ** attempt)
+                        continue
+                    return await response.json(content_type=None)
+            except aiohttp.ClientConnectorError:
+                if last_attempt:
+                    raise
+                await asyncio.sleep(self.backoff_factor * 2 ** attempt)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if last_attempt or not idempotent:
+                    raise
+                await asyncio.sleep(self.backoff_factor * 2 ** attempt)
+
+    async def aget(self, path, params=None):
+        return await self.arequest('GET', path, params=params)
+
+    async def apost(self, path, json=None):
+        return await self.arequest('POST', path, json=json)
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    async def aclose(self):
+        if self._async_session is not None:
+            await self._async_session.close()
+            self._async_session = None
+
+billing_api = BillingApiClient()
+
+# Billing API calls used by the tools, sync and async
+
+def get_rate_card():
+    return billing_api.get('/api/rate_card')
+
+def get_billing_data(app_name: str):
+    return billing_api.get('/api/billing_data', params={'resource_name': app_name})
+
+def calculate_cost(usage_data: dict):
+    return billing_api.post('/api/calculate_estimate', json={'usage_data': usage_data})
+
+async def aget_rate_card():
+    return await billing_api.aget('/api/rate_card')
+
+async def aget_billing_data(app_name: str):
+    return await billing_api.aget('/api/billing_data', params={'resource_name': app_name})
+
+async def acalculate_cost(usage_data: dict):
+    return await billing_api.apost('/api/calculate_estimate', json={'usage_data': usage_data})
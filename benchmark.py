@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Standalone benchmark of every billing API endpoint at several synthetic data sizes.
+# usage: python benchmark.py --sizes 10000,100000,1000000 --output benchmarks/results.json
+#        python benchmark.py --sizes 10000 --compare benchmarks/results.json
+# Each size is loaded into a fresh SQLite file, then every case runs through Flask's test client.
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the billing API endpoints')
+    parser.add_argument('--sizes', default='10000,100000', help='comma separated billing_data row counts')
+    parser.add_argument('--periods', type=int, default=12, help='monthly billing periods per resource')
+    parser.add_argument('--requests', type=int, default=50, help='timed requests per case')
+    parser.add_argument('--warmup', type=int, default=3, help='untimed requests per case')
+    parser.add_argument('--only', help='comma separated case names to run')
+    parser.add_argument('--output', help='write results as JSON to this path')
+    parser.add_argument('--compare', help='previous results JSON to compare p50 against')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+def bulk_payload(n_rows, start, rate_card):
+    # NDJSON body of new charges for a fresh resource, so the bulk case never overwrites loaded rows
+    lines = []
+    for i in range(n_rows):
+        sku = rate_card[i % len(rate_card)]
+        lines.append(json.dumps({
+            'charge_id': f'bench{start + i:09d}', 'sku_id': sku['sku_id'], 'service_offering': sku['service_offering'],
+            'billing_period_start': '20230101', 'billing_period_end': '20230131',
+            'resource_name': 'bench_bulk_1', 'resource_type': 'app_vm', 'usage_unit': sku['offering_unit'],
+            'usage_quantity': 10.0, 'effective_cost': 1.0,
+        }))
+    return '\n'.join(lines)
+
+def benchmark_cases(rate_card, etags):
+    # name -> callable(client, i) returning a response; writes use i to stay unique across iterations.
+    # etags maps a path to its current ETag, fetched by main after each load so it is not timed.
+    sku_ids = [sku['sku_id'] for sku in rate_card]
+    usage = {sku_id: 100.0 for sku_id in sku_ids}
+    resource = 'app_1_vm_1'
+    return {
+        'rate_card': lambda client, i: client.get('/api/rate_card'),
+        'rate_card_sku': lambda client, i: client.get(f'/api/rate_card?sku_id={sku_ids[i % len(sku_ids)]}'),
+        'rate_card_not_modified': lambda client, i: client.get('/api/rate_card', headers={'If-None-Match': etags['/api/rate_card']}),
+        'billing_data_page': lambda client, i: client.get('/api/billing_data?limit=1000'),
+        'billing_data_resource': lambda client, i: client.get(f'/api/billing_data?resource_name={resource}'),
+        'billing_data_charge': lambda client, i: client.get('/api/billing_data?charge_id=charge000000001'),
+        'billing_data_export': lambda client, i: client.get('/api/billing_data/export?resource_type=app_vm&format=ndjson'),
+        'billing_data_bulk': lambda client, i: client.post('/api/billing_data/bulk', data=bulk_payload(100, i * 100, rate_card), content_type='application/x-ndjson'),
+        'calculate_estimate': lambda client, i: client.post('/api/calculate_estimate', json={'usage_data': usage}),
+        'calculate_estimate_scenarios': lambda client, i: client.post('/api/calculate_estimate', json={'scenarios': [usage] * 50}),
+        'scenarios': lambda client, i: client.post('/api/scenarios', json={'resource_prefix': 'app_1_', 'scenarios': [{sku_ids[0]: 1}, {sku_ids[1]: 1000}]}),
+        'resource_estimate': lambda client, i: client.get(f'/api/get_resource_estimate?resource_name={resource}'),
+        'resource_estimate_grouped': lambda client, i: client.get(f'/api/get_resource_estimate?resource_name={resource}&group_by=sku_id,billing_period'),
+        'all_resource_estimates': lambda client, i: client.get('/api/all_resource_estimates'),
+        'all_resource_estimates_grouped': lambda client, i: client.get('/api/all_resource_estimates?group_by=resource_type,billing_period'),
+        'all_resource_estimates_filtered': lambda client, i: client.get('/api/all_resource_estimates?resource_type=app_vm'),
+        'all_resource_estimates_export': lambda client, i: client.get('/api/all_resource_estimates/export?format=csv'),
+        'versions': lambda client, i: client.get('/api/versions'),
+        'cost_rollups': lambda client, i: client.get('/api/cost_rollups?dimension=service_category'),
+        'rate_card_history': lambda client, i: client.get(f'/api/rate_card/history?sku_id={sku_ids[i % len(sku_ids)]}'),
+        'rate_card_history_as_of': lambda client, i: client.get(f'/api/rate_card/history?as_of=2023{i % 12 + 1:02d}15'),
+        'rate_card_history_sku_as_of': lambda client, i: client.get(f'/api/rate_card/history?sku_id={sku_ids[i % len(sku_ids)]}&as_of=2023{i % 12 + 1:02d}15'),
+        'cost_anomalies': lambda client, i: client.get('/api/cost_anomalies'),
+        'cost_anomalies_month': lambda client, i: client.get(f'/api/cost_anomalies?month=2023{i % 11 + 2:02d}&top=50'),
+        'forecast_group': lambda client, i: client.get('/api/forecast?group=app_1'),
+        'forecast_holt': lambda client, i: client.get(f'/api/forecast?key={resource}&method=holt&horizon=3'),
+        'forecast_fleet': lambda client, i: client.get('/api/forecast?dimension=resource_name&limit=20'),
+        'forecast_service_category': lambda client, i: client.get('/api/forecast?dimension=service_category'),
+        'allocations_consumer': lambda client, i: client.get(f'/api/allocations?consumer={resource}'),
+        'allocations_month': lambda client, i: client.get('/api/allocations?billing_month=202301'),
+        'allocations_run_month': lambda client, i: client.post('/api/allocations', json={'months': [f'2023{i % 12 + 1:02d}']}),
+        'resource_estimate_allocated': lambda client, i: client.get(f'/api/get_resource_estimate?resource_name={resource}&allocations=true'),
+        'all_resource_estimates_allocated': lambda client, i: client.get('/api/all_resource_estimates?allocations=true'),
+        'jobs_list': lambda client, i: client.get('/api/jobs?limit=20'),
+        # submitted jobs run in the background; main waits for them after the last case
+        'jobs_submit': lambda client, i: client.post('/api/jobs', json={'kind': 'resource_estimates', 'params': {'resource_name': resource}}),
+    }
+
+def run_case(client, call, requests, warmup):
+    for i in range(warmup):
+        call(client, i).get_data()
+    latencies = []
+    started = time.perf_counter()
+    for i in range(warmup, warmup + requests):
+        t = time.perf_counter()
+        response = call(client, i)
+        body = response.get_data()
+        latencies.append(time.perf_counter() - t)
+        if response.status_code >= 400:
+            raise RuntimeError(f'{response.status_code}: {body[:200]!r}')
+    elapsed = time.perf_counter() - started
+    latencies = np.asarray(latencies) * 1000
+    return {
+        'requests': requests,
+        'throughput': round(requests / elapsed, 2),
+        'mean_ms': round(float(latencies.mean()), 3),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+        'max_ms': round(float(latencies.max()), 3),
+        'response_bytes': len(body),
+    }
+
+def load_size(app, n_rows, periods, seed):
+    from db_utils import db
+    from cache_utils import rate_card_cache
+    from rollup_utils import rebuild_rollups
+    from allocation_utils import run_allocations
+    from synthetic_data import load_synthetic_data, resources_for_rows
+    with app.app_context():
+        started = time.perf_counter()
+        rows = load_synthetic_data(resources_for_rows(n_rows, periods), periods, seed=seed)
+        loaded = time.perf_counter()
+        rebuild_rollups()
+        db.session.commit()
+        rate_card_cache.rebuild()
+        rolled_up = time.perf_counter()
+        run_allocations()
+        allocated = time.perf_counter()
+        return rows, round(loaded - started, 3), round(rolled_up - loaded, 3), round(allocated - rolled_up, 3)
+
+def wait_for_jobs(client, timeout=600):
+    # background jobs from the write cases must finish before the next size replaces the data
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not any(client.get(f'/api/jobs?status={status}&limit=1').get_json() for status in ('queued', 'running')):
+            return
+        time.sleep(0.1)
+    raise RuntimeError('background jobs did not finish')
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, previous):
+    # prints p50 ratios against a previous run for every size/case present in both
+    previous = {(size['rows'], name): case for size in previous['sizes'] for name, case in size['cases'].items()}
+    print(f"\n{'rows':>9}  {'case':<32} {'before':>9} {'after':>9} {'ratio':>6}")
+    for size in results['sizes']:
+        for name, case in size['cases'].items():
+            before = previous.get((size['rows'], name))
+            if before:
+                ratio = case['p50_ms'] / before['p50_ms'] if before['p50_ms'] else float('inf')
+                flag = '  <-- slower' if ratio > 1.2 else ''
+                print(f"{size['rows']:>9}  {name:<32} {before['p50_ms']:>9.3f} {case['p50_ms']:>9.3f} {ratio:>6.2f}{flag}")
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    workdir = tempfile.mkdtemp(prefix='gptbma-bench-')
+    # the app reads its database URI when it is created, so point it at the scratch file first
+    os.environ['GPTBMA_DATABASE_URI'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    from app import app
+    from synthetic_data import generate_rate_card
+
+    client = app.test_client()
+    etags = {}
+    cases = benchmark_cases(generate_rate_card(), etags)
+    if args.only:
+        cases = {name: cases[name] for name in args.only.split(',')}
+    results = {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'requests': args.requests,
+        'periods': args.periods,
+        'sizes': [],
+    }
+    for n_rows in sizes:
+        rows, load_seconds, rollup_seconds, allocation_seconds = load_size(app, n_rows, args.periods, args.seed)
+        print(f'\n{rows} rows (load {load_seconds}s, rollups {rollup_seconds}s, allocations {allocation_seconds}s)')
+        print(f"{'case':<32} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+        size = {'rows': n_rows, 'loaded_rows': rows, 'load_seconds': load_seconds, 'rollup_seconds': rollup_seconds,
+                'allocation_seconds': allocation_seconds, 'cases': {}}
+        etags['/api/rate_card'] = client.get('/api/rate_card').headers['ETag']
+        for name, call in cases.items():
+            case = run_case(client, call, args.requests, args.warmup)
+            size['cases'][name] = case
+            print(f"{name:<32} {case['throughput']:>9.1f} {case['p50_ms']:>9.3f} {case['p99_ms']:>9.3f}")
+        wait_for_jobs(client)
+        results['sizes'].append(size)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nresults written to {args.output}')
+    shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import threading
+import time
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+from db_utils import RateCard, RateCardHistory, to_dict, get_table_version
+from pricing_utils import PricingEngine, PriceHistory
+
+RATE_CARD_FIELDS = ['sku_id', 'service_category', 'service_name', 'service_offering', 'offering_unit', 'pricing_unit', 'pricing_quantity', 'unit_price']
+RATE_CARD_HISTORY_FIELDS = RATE_CARD_FIELDS + ['valid_from', 'valid_to']
+
+class RateCardSnapshot:
+    # Immutable view of the rate card at one version; replaced wholesale, never mutated
+
+    def __init__(self, version, last_modified, entries, history=()):
+        self.version = version
+        self.last_modified = last_modified
+        self.entries = entries
+        self.by_sku_id = {e['sku_id']: e for e in entries}
+        self.engine = PricingEngine([e['sku_id'] for e in entries], [e['pricing_quantity'] for e in entries], [e['unit_price'] for e in entries])
+        # effective-dated prices, for pricing as of a past date
+        self.history = PriceHistory(history)
+        # the content digest keeps ETags unique even if the database is recreated and versions start over
+        digest = hashlib.sha1(json.dumps(entries, sort_keys=True).encode()).hexdigest()[:16]
+        self.etag = f'rate-card-v{version}-{digest}'
+
+    def get(self, sku_id):
+        return self.by_sku_id.get(sku_id)
+
+    def filter_by(self, service_offering):
+        return [e for e in self.entries if e['service_offering'] == service_offering]
+
+class RateCardCache:
+    # One app's rate card cache, shared by its threads. Write paths bump the rate_card table version and call
+    # rebuild() after committing, which swaps in a fresh snapshot; readers never see a half-built one.
+    # With several worker processes, a write in one worker reaches the others through the version
+    # check, made at most every check_interval seconds (None disables it).
+
+    def __init__(self, check_interval=None):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = 0.0
+        self.check_interval = check_interval
+
+    @property
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            return self.rebuild()
+        if self.check_interval is not None and time.monotonic() - self._checked_at >= self.check_interval:
+            self._checked_at = time.monotonic()
+            if get_table_version('rate_card')[0] != snapshot.version:
+                return self.rebuild()
+        return snapshot
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    @property
+    def etag(self):
+        return self.snapshot.etag
+
+    def rebuild(self):
+        with self._lock:
+            version, last_modified = get_table_version('rate_card')
+            entries = [to_dict(e, RATE_CARD_FIELDS) for e in RateCard.query.all()]
+            history = [to_dict(e, RATE_CARD_HISTORY_FIELDS) for e in RateCardHistory.query.all()]
+            self._snapshot = RateCardSnapshot(version, last_modified, entries, history)
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+def get_rate_card_cache():
+    # Each app keeps its own cache in app.extensions, so apps on different databases never serve
+    # each other's snapshot; created on first use with the app's RATE_CARD_CHECK_SECONDS
+    cache = current_app.extensions.get('rate_card_cache')
+    if cache is None:
+        cache = current_app.extensions.setdefault('rate_card_cache', RateCardCache(current_app.config.get('RATE_CARD_CHECK_SECONDS')))
+    return cache
+
+# the current app's RateCardCache
+rate_card_cache = LocalProxy(get_rate_card_cache)
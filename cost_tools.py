@@ -1,28 +1,12 @@
-import yfinance as yf
 from datetime import datetime, timedelta
-    
-from langchain.agents import AgentType
-from langchain.chat_models import ChatOpenAI
-from langchain.agents import initialize_agent
+from functools import lru_cache
 
 from typing import Type
 from pydantic import BaseModel, Field
 from langchain.tools import BaseTool
 
-import requests
-
-# Define custom functions to interact with your API
-def get_rate_card():
-    response = requests.get('http://localhost:5000/rate_card')
-    return response.json()
-
-def get_billing_data(app_name: str):
-    response = requests.get(f'http://localhost:5000/billing_data?app_name={app_name}')
-    return response.json()
-
-def calculate_cost(usage_data: dict):
-    response = requests.post('http://localhost:5000/calculate_cost', json={'usage_data': usage_data})
-    return response.json()
+from api_client import get_rate_card, get_billing_data, calculate_cost, aget_rate_card, aget_billing_data, acalculate_cost
+from tool_cache import tool_cache
 
 
 # Define input models for your tools
@@ -35,10 +19,10 @@ class RateCardTool(BaseTool):
     description = "Retrieve rate card entries."
     
     def _run(self):
-        return get_rate_card()
+        return tool_cache.call(self.name, {}, ['rate_card'], get_rate_card)
 
-    def _arun(self):
-        raise NotImplementedError("get_rate_card does not support async")
+    async def _arun(self):
+        return await tool_cache.acall(self.name, {}, ['rate_card'], aget_rate_card)
 
 class BillingDataTool(BaseTool):
     name = "get_billing_data"
@@ -46,10 +30,10 @@ class BillingDataTool(BaseTool):
     args_schema: type[BaseModel] = BillingDataInput
     
     def _run(self, app_name: str):
-        return get_billing_data(app_name)
+        return tool_cache.call(self.name, {'app_name': app_name}, ['billing_data'], get_billing_data)
 
-    def _arun(self, app_name: str):
-        raise NotImplementedError("get_billing_data does not support async")
+    async def _arun(self, app_name: str):
+        return await tool_cache.acall(self.name, {'app_name': app_name}, ['billing_data'], aget_billing_data)
 
 
 # Define input model for your tool
@@ -70,13 +54,14 @@ class CalculateCostTool(BaseTool):
     args_schema: type[BaseModel] = CalculateCostInput
     
     def _run(self, usage_data: dict):
-        return calculate_cost(usage_data)
+        return tool_cache.call(self.name, {'usage_data': usage_data}, ['rate_card'], calculate_cost)
 
-    def _arun(self, usage_data: dict):
-        raise NotImplementedError("calculate_cost does not support async")
+    async def _arun(self, usage_data: dict):
+        return await tool_cache.acall(self.name, {'usage_data': usage_data}, ['rate_card'], acalculate_cost)
 
 def get_current_stock_price(ticker):
     """Method to get current stock price"""
+    import yfinance as yf
 
     ticker_data = yf.Ticker(ticker)
     recent = ticker_data.history(period="1d")
@@ -85,6 +70,7 @@ def get_current_stock_price(ticker):
 
 def get_stock_performance(ticker, days):
     """Method to get stock price change in percentage"""
+    import yfinance as yf
 
     past_date = datetime.today() - timedelta(days=days)
     ticker_data = yf.Ticker(ticker)
@@ -140,10 +126,14 @@ class StockPerformanceTool(BaseTool):
     def _arun(self, ticker: str):
         raise NotImplementedError("get_stock_performance does not support async")
 
-llm = ChatOpenAI(model="gpt-3.5-turbo-0613", temperature=0)
-
 tools = [CurrentStockPriceTool(), StockPerformanceTool()]
 
-agent = initialize_agent(tools, llm, agent=AgentType.OPENAI_FUNCTIONS, verbose=True)
+# yfinance, the agent machinery and the OpenAI client are imported and built on first use, so
+# importing the tools stays cheap and needs no API key
+@lru_cache(maxsize=None)
+def get_agent():
+    from langchain.agents import AgentType, initialize_agent
+    from langchain.chat_models import ChatOpenAI
 
-print()
\ No newline at end of file
+    llm = ChatOpenAI(model="gpt-3.5-turbo-0613", temperature=0)
+    return initialize_agent(tools, llm, agent=AgentType.OPENAI_FUNCTIONS, verbose=True)
@@ -1,15 +1,7 @@
-import requests
 from pydantic import BaseModel, Field
 from langchain.tools import BaseTool
-
-# Define custom functions to interact with your API
-def get_rate_card():
-    response = requests.get('http://localhost/rate_card')
-    return response.json()
-
-def get_billing_data(app_name: str):
-    response = requests.get(f'http://localhost/billing_data?app_name={app_name}')
-    return response.json()
+from api_client import get_rate_card, get_billing_data, calculate_cost, aget_rate_card, aget_billing_data, acalculate_cost
+from tool_cache import tool_cache
 
 # Define input models for your tools
 class BillingDataInput(BaseModel):
@@ -21,10 +13,10 @@ class RateCardTool(BaseTool):
     description = "Retrieve rate card entries."
     
     def _run(self):
-        return get_rate_card()
+        return tool_cache.call(self.name, {}, ['rate_card'], get_rate_card)
 
-    def _arun(self):
-        raise NotImplementedError("get_rate_card does not support async")
+    async def _arun(self):
+        return await tool_cache.acall(self.name, {}, ['rate_card'], aget_rate_card)
 
 class BillingDataTool(BaseTool):
     name = "get_billing_data"
@@ -32,15 +24,10 @@ class BillingDataTool(BaseTool):
     args_schema: type[BaseModel] = BillingDataInput
     
     def _run(self, app_name: str):
-        return get_billing_data(app_name)
-
-    def _arun(self, app_name: str):
-        raise NotImplementedError("get_billing_data does not support async")
+        return tool_cache.call(self.name, {'app_name': app_name}, ['billing_data'], get_billing_data)
 
-# Define a custom function to interact with the /calculate_cost endpoint
-def calculate_cost(usage_data: dict):
-    response = requests.post('http://localhost/calculate_cost', json={'usage_data': usage_data})
-    return response.json()
+    async def _arun(self, app_name: str):
+        return await tool_cache.acall(self.name, {'app_name': app_name}, ['billing_data'], aget_billing_data)
 
 # Define input model for your tool
 class CalculateCostInput(BaseModel):
@@ -53,7 +40,7 @@ class CalculateCostTool(BaseTool):
     args_schema: type[BaseModel] = CalculateCostInput
     
     def _run(self, usage_data: dict):
-        return calculate_cost(usage_data)
+        return tool_cache.call(self.name, {'usage_data': usage_data}, ['rate_card'], calculate_cost)
 
-    def _arun(self, usage_data: dict):
-        raise NotImplementedError("calculate_cost does not support async")
+    async def _arun(self, usage_data: dict):
+        return await tool_cache.acall(self.name, {'usage_data': usage_data}, ['rate_card'], acalculate_cost)
@@ -0,0 +1,50 @@
+from sqlalchemy import func
+from db_utils import db, BillingData, parse_billing_period
+
+# Columns the estimate endpoints can group and filter on, keyed by their API name
+GROUPABLE_COLUMNS = {
+    'resource_name': BillingData.resource_name,
+    'resource_type': BillingData.resource_type,
+    'sku_id': BillingData.sku_id,
+    'billing_period': BillingData.billing_period_start,
+}
+
+def parse_group_by(value, default=None):
+    # "resource_type,billing_period" -> ['resource_type', 'billing_period']
+    if not value:
+        return list(default or [])
+    group_by = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in group_by if name not in GROUPABLE_COLUMNS]
+    if unknown:
+        raise ValueError(f"cannot group by {', '.join(unknown)}; expected one of {', '.join(GROUPABLE_COLUMNS)}")
+    return group_by
+
+def parse_filters(args):
+    # The GROUPABLE_COLUMNS filters in a request's args or a job's params, as aggregate_query
+    # filters. billing_period is parsed up front so a malformed one raises ValueError instead of
+    # failing the query.
+    filters = {name: args.get(name) for name in GROUPABLE_COLUMNS}
+    if filters['billing_period'] is not None:
+        filters['billing_period'] = parse_billing_period(filters['billing_period'])
+    return filters
+
+def aggregate_query(group_by=(), **filters):
+    # SELECT <group_by...>, SUM(effective_cost) ... GROUP BY <group_by...>
+    columns = [GROUPABLE_COLUMNS[name].label(name) for name in group_by]
+    total = func.coalesce(func.sum(BillingData.effective_cost), 0).label('effective_cost')
+    query = db.select(*columns, total)
+    for name, value in filters.items():
+        if value is not None:
+            query = query.where(GROUPABLE_COLUMNS[name] == value)
+    if columns:
+        query = query.group_by(*columns).order_by(*columns)
+    return query
+
+def aggregate_costs(group_by=(), **filters):
+    # One GROUP BY/SUM query; returns one dict per group with the summed effective_cost
+    result = db.session.connection().execute(aggregate_query(group_by, **filters))
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
+def total_cost(**filters):
+    return aggregate_costs(**filters)[0]['effective_cost']
@@ -0,0 +1,62 @@
+import csv
+import io
+import json
+
+from flask import Response, stream_with_context
+from sqlalchemy.exc import StatementError
+from db_utils import db
+
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+DEFAULT_YIELD_PER = 1000
+
+def ndjson_chunks(partitions, fields):
+    for rows in partitions:
+        yield ''.join(json.dumps(dict(zip(fields, row)), default=str) + '\n' for row in rows)
+
+def csv_chunks(partitions, fields):
+    # one reusable buffer, drained after every partition
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(fields)
+    for rows in partitions:
+        writer.writerows(rows)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+def export_response(statement, fields, fmt, filename, yield_per=DEFAULT_YIELD_PER):
+    # Streams statement's rows as NDJSON or CSV; at most yield_per rows are held in memory at once.
+    # fields names the selected columns, in order.
+    if fmt not in EXPORT_MIMETYPES:
+        raise ValueError(f"unsupported export format {fmt}; expected one of {', '.join(EXPORT_MIMETYPES)}")
+
+    # the statement runs before the response starts, so a failing query becomes an error response
+    # instead of a 200 with a truncated body
+    try:
+        result = db.session.execute(statement.execution_options(yield_per=yield_per))
+    except StatementError as e:
+        # a filter value its column could not bind, e.g. a malformed billing period
+        if isinstance(e.orig, ValueError):
+            raise ValueError(str(e.orig)) from e
+        raise
+
+    def generate():
+        try:
+            partitions = (list(rows) for rows in result.partitions())
+            if fmt == 'csv':
+                yield from csv_chunks(partitions, fields)
+            else:
+                yield from ndjson_chunks(partitions, fields)
+        finally:
+            result.close()
+
+    response = Response(stream_with_context(generate()), mimetype=EXPORT_MIMETYPES[fmt])
+    # a generator that never starts (HEAD, early disconnect) never reaches its finally
+    response.call_on_close(result.close)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}.{fmt}'
+    return response
@@ -0,0 +1,163 @@
+import threading
+from statistics import NormalDist
+
+import numpy as np
+
+# Per-key cost forecasts fitted to the last `history` months of a CostMatrix, for every key in
+# one set of array operations. Fits are cached against the matrix object, which the matrix cache
+# replaces whenever billing data or the rate card changes.
+
+FORECAST_METHODS = ['linear', 'holt']
+DEFAULT_HISTORY = 12
+MIN_HISTORY = 3
+MAX_HORIZON = 12
+DEFAULT_LEVEL = 0.8
+# Holt's linear exponential smoothing weights for the level and the trend
+DEFAULT_ALPHA = 0.5
+DEFAULT_BETA = 0.1
+MAX_CACHED_FITS = 32
+
+class Fit:
+    # Per-row model state: next-month values follow base + slope * h, and the h-step forecast
+    # standard deviation is sigma * spread[h]
+
+    def __init__(self, matrix, months, base, slope, sigma, spread):
+        self.matrix = matrix
+        self.months = months
+        self.base = base
+        self.slope = slope
+        self.sigma = sigma
+        self.spread = spread
+
+def fit_linear(y, horizon):
+    # Least squares trend through each row, with the textbook prediction interval width
+    n = y.shape[1]
+    t = np.arange(n, dtype=np.float64)
+    t_mean = t.mean()
+    stt = ((t - t_mean) ** 2).sum()
+    y_mean = y.mean(axis=1)
+    slope = (y - y_mean[:, None]) @ (t - t_mean) / stt
+    intercept = y_mean - slope * t_mean
+    residuals = y - (intercept[:, None] + slope[:, None] * t)
+    sigma = np.sqrt((residuals ** 2).sum(axis=1) / (n - 2))
+    h = np.arange(1, horizon + 1)
+    spread = np.sqrt(1 + 1 / n + (n - 1 + h - t_mean) ** 2 / stt)
+    # base is the fitted value at the last observed month, so month h is base + slope * h
+    return intercept + slope * (n - 1), slope, sigma, spread
+
+def fit_holt(y, horizon, alpha=DEFAULT_ALPHA, beta=DEFAULT_BETA):
+    # Holt's linear method run over all rows at once, one vector step per month
+    level = y[:, 0].copy()
+    trend = y[:, 1] - y[:, 0]
+    squared_errors = np.zeros(y.shape[0])
+    for j in range(1, y.shape[1]):
+        forecast = level + trend
+        error = y[:, j] - forecast
+        squared_errors += error ** 2
+        previous_level = level
+        level = forecast + alpha * error
+        trend = trend + beta * (level - previous_level - trend)
+    sigma = np.sqrt(squared_errors / (y.shape[1] - 1))
+    # h-step variance of the additive-trend model: sigma^2 * (1 + sum_{j<h} (alpha * (1 + beta * j))^2)
+    j = np.arange(1, horizon)
+    spread = np.sqrt(1 + np.concatenate([[0.0], np.cumsum((alpha * (1 + beta * j)) ** 2)]))
+    return level, trend, sigma, spread
+
+def fit(matrix, y, method, history, horizon, alpha, beta):
+    months = matrix.months[-history:]
+    if method == 'linear':
+        return Fit(matrix, months, *fit_linear(y, horizon))
+    return Fit(matrix, months, *fit_holt(y, horizon, alpha, beta))
+
+def predict(fit, rows, horizon, level):
+    # (forecast, lower, upper) arrays of shape (len(rows), horizon); costs never go below 0
+    z = NormalDist().inv_cdf((1 + level) / 2)
+    h = np.arange(1, horizon + 1)
+    forecast = fit.base[rows, None] + fit.slope[rows, None] * h
+    width = z * fit.sigma[rows, None] * fit.spread[:horizon]
+    return np.maximum(forecast, 0), np.maximum(forecast - width, 0), np.maximum(forecast + width, 0)
+
+def future_months(last, horizon):
+    year, month = int(last[:4]), int(last[4:])
+    months = []
+    for _ in range(horizon):
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        months.append(f'{year:04d}{month:02d}')
+    return months
+
+def matches_group(key, group):
+    # "app_1" covers app_1 itself and app_1_vm_1, app_1_logs, ... but not app_10_*
+    return key == group or key.startswith(group + '_')
+
+class Forecaster:
+    # Caches one Fit of all keys per (matrix, method, history, smoothing weights)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._fits = {}
+
+    def fit_all(self, matrix, method, history, alpha, beta):
+        cache_key = (matrix.dimension, method, history, alpha, beta)
+        cached = self._fits.get(cache_key)
+        if cached is not None and cached.matrix is matrix:
+            return cached
+        with self._lock:
+            cached = self._fits.get(cache_key)
+            if cached is None or cached.matrix is not matrix:
+                if len(self._fits) >= MAX_CACHED_FITS:
+                    self._fits.clear()
+                cached = self._fits[cache_key] = fit(matrix, matrix.costs[:, -history:], method, history, MAX_HORIZON, alpha, beta)
+            return cached
+
+    def forecast(self, matrix, key=None, group=None, method='linear', horizon=1, history=DEFAULT_HISTORY, level=DEFAULT_LEVEL,
+                 alpha=DEFAULT_ALPHA, beta=DEFAULT_BETA, limit=20):
+        # One key, a key group (fitted on its summed series), or the whole fleet: the fleet total
+        # plus the `limit` keys with the highest next-month forecast
+        if method not in FORECAST_METHODS:
+            raise ValueError(f"unknown method {method}; expected one of {', '.join(FORECAST_METHODS)}")
+        if not 1 <= horizon <= MAX_HORIZON:
+            raise ValueError(f"horizon must be between 1 and {MAX_HORIZON}")
+        if not 0 < level < 1:
+            raise ValueError("level must be between 0 and 1")
+        if not 0 < alpha <= 1 or not 0 <= beta <= 1:
+            raise ValueError("alpha must be in (0, 1] and beta in [0, 1]")
+        history = min(history, len(matrix.months))
+        if history < MIN_HISTORY:
+            raise ValueError(f"need at least {MIN_HISTORY} months of history to forecast")
+        result = {
+            'dimension': matrix.dimension, 'method': method, 'level': level,
+            'history_months': matrix.months[-history:], 'months': future_months(matrix.months[-1], horizon),
+        }
+        if key is not None:
+            if key not in matrix.key_index:
+                return None
+            fitted = self.fit_all(matrix, method, history, alpha, beta)
+            forecast, lower, upper = predict(fitted, [matrix.key_index[key]], horizon, level)
+            return {**result, 'key': key, 'forecast': forecast[0].tolist(), 'lower': lower[0].tolist(), 'upper': upper[0].tolist()}
+
+        if group is not None:
+            rows = [i for i, k in enumerate(matrix.keys) if matches_group(k, group)]
+            if not rows:
+                return None
+            y = matrix.costs[rows, -history:].sum(axis=0, keepdims=True)
+            summed = fit(matrix, y, method, history, horizon, alpha, beta)
+            forecast, lower, upper = predict(summed, [0], horizon, level)
+            return {**result, 'group': group, 'keys': [matrix.keys[i] for i in rows],
+                    'forecast': forecast[0].tolist(), 'lower': lower[0].tolist(), 'upper': upper[0].tolist()}
+
+        fitted = self.fit_all(matrix, method, history, alpha, beta)
+        forecast, lower, upper = predict(fitted, slice(None), horizon, level)
+        total = fit(matrix, matrix.costs[:, -history:].sum(axis=0, keepdims=True), method, history, horizon, alpha, beta)
+        total_forecast, total_lower, total_upper = predict(total, [0], horizon, level)
+        limit = min(limit, len(matrix.keys))
+        top = np.argpartition(forecast[:, 0], -limit)[-limit:] if limit else np.array([], dtype=np.intp)
+        top = top[np.argsort(forecast[top, 0])[::-1]]
+        result['total'] = {'forecast': total_forecast[0].tolist(), 'lower': total_lower[0].tolist(), 'upper': total_upper[0].tolist()}
+        result['keys'] = len(matrix.keys)
+        result['forecasts'] = [
+            {'key': matrix.keys[i], 'forecast': forecast[i].tolist(), 'lower': lower[i].tolist(), 'upper': upper[i].tolist()}
+            for i in top.tolist()
+        ]
+        return result
+
+forecaster = Forecaster()
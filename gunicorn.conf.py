@@ -0,0 +1,24 @@
+# gunicorn settings, each overridable from the environment
+import multiprocessing
+import os
+
+bind = os.environ.get('GPTBMA_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GPTBMA_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+# threaded workers: SQLite readers don't block each other under WAL, so threads add real concurrency
+worker_class = 'gthread'
+threads = int(os.environ.get('GPTBMA_THREADS', 4))
+timeout = int(os.environ.get('GPTBMA_TIMEOUT', 60))
+keepalive = int(os.environ.get('GPTBMA_KEEPALIVE', 5))
+max_requests = int(os.environ.get('GPTBMA_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+# create the app (schema upgrade and rollup backfill, unless GPTBMA_LAZY_SETUP=1 leaves those to
+# `flask --app app init-db`) once in the master instead of racing in every worker
+preload_app = True
+
+def post_fork(server, worker):
+    # connections opened by the master must not be shared with forked workers
+    from app import app
+    from db_utils import db
+    with app.app_context():
+        db.engine.dispose(close=False)
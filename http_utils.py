@@ -0,0 +1,101 @@
+import gzip
+import zlib
+
+from flask import current_app, make_response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/csv', 'text/plain'}
+
+def supported_encodings():
+    # in order of preference when the client accepts both equally
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+def etag_variants(etag):
+    # compressed representations carry the encoding as an ETag suffix, see compress_response
+    return [etag] + [f'{etag}-{encoding}' for encoding in supported_encodings()]
+
+def is_not_modified(etag, last_modified):
+    # If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.2.2)
+    if request.if_none_match:
+        return any(request.if_none_match.contains_weak(tag) for tag in etag_variants(etag))
+    if request.if_modified_since and last_modified:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # clients may keep the body but must revalidate before reusing it
+    response.cache_control.no_cache = True
+    response.vary.add('Accept-Encoding')
+    return response
+
+def not_modified(etag, last_modified):
+    response = make_response('', 304)
+    set_validators(response, etag, last_modified)
+    # echo the representation the client matched so it keeps its compressed copy
+    for tag in etag_variants(etag):
+        if request.if_none_match.contains_weak(tag):
+            response.set_etag(tag)
+    return response
+
+def stream_compressor(encoding):
+    # (compress, finish) of an incremental compressor producing one gzip or brotli stream
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=current_app.config['COMPRESS_LEVEL'])
+        return compressor.process, compressor.finish
+    # wbits 31: a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(current_app.config['COMPRESS_LEVEL'], zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+def compressed_chunks(chunks, compress, finish):
+    # Compresses a streamed body chunk by chunk; the compressor buffers small chunks, so only full
+    # blocks are sent. Closes the original iterable, e.g. an export's open cursor, at the end.
+    try:
+        for chunk in chunks:
+            data = compress(chunk.encode() if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def compress_response(response):
+    if (response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(supported_encodings())
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        # exports: the size is unknown up front, so the body is compressed as it streams, without a
+        # Content-Length. The compressor is created here, where the app config is still reachable.
+        response.response = compressed_chunks(response.response, *stream_compressor(encoding))
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+            return response
+        if encoding == 'br':
+            data = brotli.compress(data, quality=current_app.config['COMPRESS_LEVEL'])
+        else:
+            data = gzip.compress(data, compresslevel=current_app.config['COMPRESS_LEVEL'])
+        response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak)
+    return response
+
+def init_compression(app):
+    # gzip/brotli for response bodies of at least COMPRESS_MIN_SIZE bytes, and for every streamed body
+    app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+    app.config.setdefault('COMPRESS_LEVEL', 6)
+    app.after_request(compress_response)
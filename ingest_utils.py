@@ -0,0 +1,232 @@
+import codecs
+import csv
+import io
+import json
+import time
+
+from db_utils import db, RateCard, BillingData, bump_table_version, dialect_insert, parse_billing_period
+from rollup_utils import RollupDeltas, ROLLUP_FIELDS
+
+DEFAULT_BATCH_SIZE = 5000
+# Only the first few rejected rows are echoed back, the rest are only counted
+MAX_REPORTED_REJECTIONS = 100
+READ_CHUNK_SIZE = 64 * 1024
+
+BILLING_DATA_COLUMNS = ['charge_id', 'sku_id', 'service_offering', 'billing_period_start', 'billing_period_end', 'resource_name', 'resource_type', 'usage_unit', 'usage_quantity', 'effective_cost']
+REQUIRED_COLUMNS = [c for c in BILLING_DATA_COLUMNS if c != 'effective_cost']
+FLOAT_COLUMNS = ['usage_quantity', 'effective_cost']
+PERIOD_COLUMNS = ['billing_period_start', 'billing_period_end']
+
+FORMATS_BY_MIMETYPE = {
+    'application/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/csv': 'csv',
+}
+
+class IngestError(Exception):
+    pass
+
+def iter_text_chunks(stream, chunk_size=READ_CHUNK_SIZE):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            tail = decoder.decode(b'', final=True)
+            if tail:
+                yield tail
+            return
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+
+def iter_json_array(stream):
+    # Incrementally decode the elements of a top level JSON array without reading the whole body
+    decoder = json.JSONDecoder()
+    chunks = iter_text_chunks(stream)
+    buf = ''
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            return False
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf) or not fill():
+                return
+
+    skip_whitespace()
+    if pos >= len(buf) or buf[pos] != '[':
+        raise IngestError("expected a JSON array")
+    pos += 1
+    expect_value = True
+    while True:
+        skip_whitespace()
+        if pos >= len(buf):
+            raise IngestError("unexpected end of JSON array")
+        if buf[pos] == ']':
+            return
+        if not expect_value:
+            if buf[pos] != ',':
+                raise IngestError(f"expected ',' or ']' in JSON array, got {buf[pos]!r}")
+            pos += 1
+            expect_value = True
+            continue
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if fill():
+                    continue
+                raise IngestError("malformed JSON array element")
+            # a value that ends exactly at the end of the buffer may be a truncated number
+            if end >= len(buf) and not eof and fill():
+                continue
+            break
+        pos = end
+        expect_value = False
+        yield value
+
+def iter_ndjson_records(stream):
+    # Malformed lines become rejected rows instead of aborting the whole import
+    for line in iter_ndjson_lines(stream):
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            yield IngestError(f"malformed JSON line: {e}")
+
+def iter_ndjson_lines(stream):
+    buf = ''
+    for chunk in iter_text_chunks(stream):
+        buf += chunk
+        *lines, buf = buf.split('\n')
+        for line in lines:
+            if line.strip():
+                yield line
+    if buf.strip():
+        yield buf
+
+def iter_csv(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    yield from csv.DictReader(text)
+
+def iter_records(stream, fmt):
+    if fmt == 'json':
+        return iter_json_array(stream)
+    if fmt == 'ndjson':
+        return iter_ndjson_records(stream)
+    if fmt == 'csv':
+        return iter_csv(stream)
+    raise IngestError(f"unsupported format {fmt}; expected one of json, ndjson, csv")
+
+def detect_format(mimetype, fmt=None):
+    if fmt:
+        return fmt
+    if mimetype in FORMATS_BY_MIMETYPE:
+        return FORMATS_BY_MIMETYPE[mimetype]
+    raise IngestError(f"unsupported content type {mimetype or 'none'}; use application/json, application/x-ndjson or text/csv")
+
+def validate_charge(obj, known_sku_ids):
+    if isinstance(obj, Exception):
+        raise obj
+    if not isinstance(obj, dict):
+        raise IngestError("row is not an object")
+    missing = [c for c in REQUIRED_COLUMNS if obj.get(c) in (None, '')]
+    if missing:
+        raise IngestError(f"missing {', '.join(missing)}")
+    row = {c: obj.get(c) for c in BILLING_DATA_COLUMNS}
+    for c in FLOAT_COLUMNS:
+        if row[c] in (None, ''):
+            row[c] = None
+            continue
+        try:
+            row[c] = float(row[c])
+        except (TypeError, ValueError):
+            raise IngestError(f"{c} is not a number")
+    for c in BILLING_DATA_COLUMNS:
+        if c not in FLOAT_COLUMNS:
+            row[c] = str(row[c])
+    for c in PERIOD_COLUMNS:
+        try:
+            row[c] = parse_billing_period(row[c])
+        except ValueError as e:
+            raise IngestError(f"{c}: {e}")
+    if row['sku_id'] not in known_sku_ids:
+        raise IngestError(f"unknown sku_id {row['sku_id']}")
+    return row
+
+def upsert_statement():
+    try:
+        stmt = dialect_insert(BillingData)
+    except ValueError as e:
+        raise IngestError(str(e))
+    return stmt.on_conflict_do_update(
+        index_elements=[BillingData.charge_id],
+        set_={c: stmt.excluded[c] for c in BILLING_DATA_COLUMNS if c != 'charge_id'},
+    )
+
+def bulk_upsert_billing_data(records, batch_size=DEFAULT_BATCH_SIZE, on_batch=None):
+    # Upsert on charge_id, committing one transaction per batch of rows; on_batch(report) runs
+    # after each commit. A parse or database error, or one raised by on_batch, stops the import
+    # and is reported under "error".
+    known_sku_ids = {sku_id for sku_id, in db.session.query(RateCard.sku_id)}
+    stmt = upsert_statement()
+    report = {"rows": 0, "rejected": 0, "rejected_rows": [], "batches": []}
+    started = time.perf_counter()
+    batch = {}
+
+    def flush():
+        batch_started = time.perf_counter()
+        # rollups: take out what the charges being overwritten contributed, then add the new rows
+        deltas = RollupDeltas()
+        columns = [getattr(BillingData, c) for c in ROLLUP_FIELDS]
+        existing = db.session.execute(db.select(*columns).where(BillingData.charge_id.in_(list(batch)))).mappings()
+        deltas.add_charges(existing, sign=-1)
+        deltas.add_charges(batch.values())
+        db.session.execute(stmt, list(batch.values()))
+        deltas.apply()
+        bump_table_version('billing_data')
+        db.session.commit()
+        seconds = time.perf_counter() - batch_started
+        report["batches"].append({"batch": len(report["batches"]) + 1, "rows": len(batch), "seconds": round(seconds, 6), "rows_per_second": round(len(batch) / seconds, 1) if seconds else None})
+        report["rows"] += len(batch)
+        batch.clear()
+        if on_batch is not None:
+            on_batch(report)
+
+    try:
+        for index, obj in enumerate(records):
+            try:
+                row = validate_charge(obj, known_sku_ids)
+            except IngestError as e:
+                report["rejected"] += 1
+                if len(report["rejected_rows"]) < MAX_REPORTED_REJECTIONS:
+                    report["rejected_rows"].append({"row": index, "error": str(e)})
+                continue
+            # later duplicates of a charge_id win, as they would across batches
+            batch.pop(row['charge_id'], None)
+            batch[row['charge_id']] = row
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+    except Exception as e:
+        # batches committed so far stay committed, the failing batch is rolled back
+        db.session.rollback()
+        report["error"] = str(e)
+    finally:
+        report["seconds"] = round(time.perf_counter() - started, 6)
+        report["rows_per_second"] = round(report["rows"] / report["seconds"], 1) if report["seconds"] else None
+    return report
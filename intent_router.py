@@ -0,0 +1,165 @@
+import re
+import time
+from dataclasses import dataclass, field
+
+from api_client import billing_api
+
+# Answers the common cost question templates straight from the billing API and only hands
+# everything else to the LLM agent. The API client and the fallback are injected, so the
+# router runs offline with stubs.
+
+NUMBER = r'(?P<usage>\d+(?:\.\d+)?)'
+NAME = r'(?P<resource>[\w.-]+?)'
+
+# (intent, pattern) pairs tried in order against the lower-cased question; an intent may have several
+INTENT_PATTERNS = [
+    ('what_if', re.compile(rf"cost (?:of|for) {NAME} (?:be )?if (?:the )?(?P<sku>[\w.-]+) usage (?:changed|changes|is changed|was|were|is|goes|went) (?:to )?{NUMBER}")),
+    ('top_resources', re.compile(r"\btop (?P<n>\d+)\b.*\b(?:resources|apps|applications)\b")),
+    ('top_resources', re.compile(r"\b(?:(?P<n>\d+) )?(?:most expensive|costliest) (?:resources|apps|applications)\b")),
+    ('forecast', re.compile(rf"\b(?:what|how much) will {NAME} cost\b")),
+    ('forecast', re.compile(rf"\bforecast(?:ed)? (?:cost )?(?:of|for) {NAME}$")),
+    ('sku_price', re.compile(r"\b(?:unit )?(?:price|rate) (?:of|for) (?P<sku>sku[\w-]+)")),
+    ('resource_total', re.compile(rf"\bcost (?:of|for) {NAME}\s*\??$")),
+    ('resource_total', re.compile(rf"\bhow much (?:does|did|is) {NAME} (?:cost|costing)\b")),
+]
+
+@dataclass
+class RouterResult:
+    intent: str
+    answer: str
+    data: object = None
+    seconds: float = 0.0
+
+@dataclass
+class RouterStats:
+    queries: int = 0
+    hits: int = 0
+    fast_path_seconds: float = 0.0
+    fallback_seconds: float = 0.0
+    by_intent: dict = field(default_factory=dict)
+
+    def report(self, llm_seconds_estimate):
+        # latency saved: each hit would otherwise have cost an average LLM round trip
+        misses = self.queries - self.hits
+        llm_seconds = self.fallback_seconds / misses if misses else llm_seconds_estimate
+        return {
+            "queries": self.queries,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.queries if self.queries else 0.0,
+            "by_intent": dict(self.by_intent),
+            "avg_fast_path_seconds": self.fast_path_seconds / self.hits if self.hits else 0.0,
+            "avg_llm_seconds": llm_seconds,
+            "estimated_seconds_saved": self.hits * llm_seconds - self.fast_path_seconds,
+        }
+
+def matches_resource(name, resource):
+    # "app_1" covers app_1 itself and app_1_vm_1, app_1_logs, ... but not app_10_*
+    return name == resource or name.startswith(resource + '_')
+
+class IntentRouter:
+
+    def __init__(self, fallback, api=billing_api, llm_seconds_estimate=5.0):
+        self.fallback = fallback
+        self.api = api
+        self.llm_seconds_estimate = llm_seconds_estimate
+        self.stats = RouterStats()
+
+    def match(self, question):
+        text = ' '.join(question.lower().split()).rstrip('?.! ')
+        for intent, pattern in INTENT_PATTERNS:
+            m = pattern.search(text)
+            if m:
+                return intent, {k: v for k, v in m.groupdict().items() if v is not None}
+        return None, None
+
+    def route(self, question):
+        # Returns a RouterResult from the fast path, or None when the question needs the LLM
+        started = time.perf_counter()
+        intent, params = self.match(question)
+        if intent is None:
+            return None
+        result = getattr(self, f'answer_{intent}')(**params)
+        if result is not None:
+            result.seconds = time.perf_counter() - started
+        return result
+
+    def answer(self, question):
+        self.stats.queries += 1
+        result = self.route(question)
+        if result is not None:
+            self.stats.hits += 1
+            self.stats.fast_path_seconds += result.seconds
+            self.stats.by_intent[result.intent] = self.stats.by_intent.get(result.intent, 0) + 1
+            return result.answer
+        started = time.perf_counter()
+        try:
+            return self.fallback(question)
+        finally:
+            self.stats.fallback_seconds += time.perf_counter() - started
+
+    def report(self):
+        return self.stats.report(self.llm_seconds_estimate)
+
+    def resource_costs(self, resource):
+        # the server narrows the rollups to the resource and its sub-resources
+        rows = self.api.get('/api/cost_rollups', params={'dimension': 'resource_name', 'by_month': 'false', 'group': resource})
+        return {row['key']: row['effective_cost'] for row in rows if matches_resource(row['key'], resource)}
+
+    def answer_resource_total(self, resource):
+        costs = self.resource_costs(resource)
+        if not costs:
+            return None
+        total = sum(costs.values())
+        detail = '' if list(costs) == [resource] else f" across {len(costs)} resources"
+        return RouterResult('resource_total', f"The total cost of {resource} is {total:.2f}{detail}.", {"resource": resource, "total": total, "by_resource": costs})
+
+    def answer_sku_price(self, sku):
+        entry = self.api.get('/api/rate_card', params={'sku_id': sku})
+        if 'unit_price' not in entry:
+            return None
+        quantity = entry['pricing_quantity']
+        per = f"{entry['offering_unit']} per {entry['pricing_unit']}" if quantity == 1 else f"{quantity:g} {entry['offering_unit']} per {entry['pricing_unit']}"
+        return RouterResult('sku_price', f"{sku} ({entry['service_name']} {entry['service_offering']}) costs {entry['unit_price']} per {per}.", entry)
+
+    def answer_top_resources(self, n=None):
+        n = int(n or 5)
+        # top-N straight from the server, costliest first
+        top = self.api.get('/api/cost_rollups', params={'dimension': 'resource_name', 'by_month': 'false', 'limit': n})
+        lines = [f"{i + 1}. {row['key']}: {row['effective_cost']:.2f}" for i, row in enumerate(top)]
+        return RouterResult('top_resources', f"Top {len(top)} resources by cost:\n" + '\n'.join(lines), top)
+
+    def answer_forecast(self, resource):
+        result = self.api.get('/api/forecast', params={'group': resource})
+        if 'forecast' not in result:
+            return None
+        keys = result['keys']
+        detail = '' if keys == [resource] else f" across {len(keys)} resources"
+        answer = (f"{resource} is forecast to cost {result['forecast'][0]:.2f} in {result['months'][0]} "
+                  f"({result['level']:.0%} interval {result['lower'][0]:.2f} to {result['upper'][0]:.2f}), "
+                  f"from a {result['method']} trend over {len(result['history_months'])} months{detail}.")
+        return RouterResult('forecast', answer, result)
+
+    def resolve_skus(self, name):
+        # "sku001", or "<service_category>_<service_offering>" such as compute_cpu
+        rate_card = self.api.get('/api/rate_card')
+        by_id = {entry['sku_id']: entry for entry in rate_card}
+        if name in by_id:
+            return [name]
+        return [sku_id for sku_id, entry in by_id.items() if f"{entry['service_category']}_{entry['service_offering']}".lower() == name]
+
+    def answer_what_if(self, resource, sku, usage):
+        skus = self.resolve_skus(sku)
+        if not skus:
+            return None
+        payload = {'resource_prefix': resource, 'scenarios': [{'name': f"{sku} usage {usage}", 'overrides': {s: float(usage) for s in skus}}]}
+        result = self.api.post('/api/scenarios', json=payload)
+        if 'scenarios' not in result:
+            return None
+        # the prefix may also pick up unrelated resources such as app_10_*; keep ours only
+        baseline = {k: v for k, v in result['baseline']['by_resource'].items() if matches_resource(k, resource)}
+        scenario = {k: v for k, v in result['scenarios'][0]['by_resource'].items() if matches_resource(k, resource)}
+        if not baseline:
+            return None
+        before, after = sum(baseline.values()), sum(scenario.values())
+        answer = f"At current rate card prices, {resource} would cost {after:.2f} instead of {before:.2f} ({after - before:+.2f}) if {sku} usage changed to {usage}."
+        return RouterResult('what_if', answer, {"resource": resource, "skus": skus, "baseline": before, "cost": after, "delta": after - before})
@@ -0,0 +1,278 @@
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy.exc import OperationalError
+from werkzeug.local import LocalProxy
+
+from db_utils import db, Job
+from estimate_utils import parse_group_by, parse_filters, aggregate_costs
+from ingest_utils import DEFAULT_BATCH_SIZE, iter_records, bulk_upsert_billing_data
+from rate_history_utils import add_rate_card_entries
+from reprice_utils import DEFAULT_PARTITION_SIZE, create_run, reprice
+from rollup_utils import ROLLUP_DIMENSIONS, rebuild_rollups
+from allocation_utils import run_allocations
+
+# In-process background jobs persisted in the job table. Each process runs the jobs it accepted
+# on a small thread pool inside an app context; progress and cancellation go through the table,
+# so any worker process can answer a poll or take a cancel request.
+
+JOB_STATUSES = ['queued', 'running', 'succeeded', 'failed', 'cancelled']
+ACTIVE_STATUSES = ('queued', 'running')
+DEFAULT_JOB_WORKERS = 2
+# minimum seconds between progress writes and between cancel checks of one job
+PROGRESS_INTERVAL = 0.5
+
+# kind -> handler(context, **params) returning a JSON-serializable result
+JOB_HANDLERS = {}
+
+class JobCancelled(Exception):
+    pass
+
+def job_handler(kind):
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def job_to_dict(job):
+    return {
+        'id': job.id, 'kind': job.kind, 'status': job.status,
+        'params': json.loads(job.params), 'result': json.loads(job.result) if job.result is not None else None,
+        'error': job.error, 'progress': job.progress, 'message': job.message,
+        'cancel_requested': job.cancel_requested,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+class JobContext:
+    # Handed to handlers: progress(fraction, message) and check_cancelled() should be called
+    # between the handler's transactions. Both use their own short connection and are throttled.
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._reported_at = 0.0
+        self._checked_at = 0.0
+        self._cancelled = False
+
+    def progress(self, fraction=None, message=None, force=False):
+        now = time.monotonic()
+        if not force and now - self._reported_at < PROGRESS_INTERVAL:
+            return
+        self._reported_at = now
+        values = {'message': message[:200] if message else None}
+        if fraction is not None:
+            values['progress'] = round(min(max(fraction, 0.0), 1.0), 4)
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(db.update(Job).where(Job.id == self.job_id).values(**values))
+        except OperationalError:
+            # progress is best effort; a locked database must not fail the job
+            pass
+
+    def cancelled(self):
+        now = time.monotonic()
+        if not self._cancelled and now - self._checked_at >= PROGRESS_INTERVAL:
+            self._checked_at = now
+            with db.engine.connect() as conn:
+                self._cancelled = bool(conn.execute(db.select(Job.cancel_requested).where(Job.id == self.job_id)).scalar())
+        return self._cancelled
+
+    def check_cancelled(self):
+        if self.cancelled():
+            raise JobCancelled()
+
+class JobQueue:
+    # One app's queue: its jobs run in that app's context on the queue's own threads
+
+    def __init__(self, app):
+        app.config.setdefault('JOB_WORKERS', DEFAULT_JOB_WORKERS)
+        self.app = app
+        self._executor = None
+        self._recovered = False
+        self._lock = threading.Lock()
+        # recovery waits for the first request, so creating the app costs no query
+        app.before_request(self.recover_once)
+
+    def recover_once(self):
+        if self._recovered:
+            return
+        with self._lock:
+            if not self._recovered:
+                self.recover()
+                self._recovered = True
+
+    def executor(self):
+        # created on first use, so a gunicorn master that preloads the app never owns job threads
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.app.config['JOB_WORKERS'], thread_name_prefix='job')
+            return self._executor
+
+    def recover(self):
+        # Jobs whose process on this host is gone can never finish; fail them
+        host = socket.gethostname()
+        orphaned = []
+        for job in Job.query.filter(Job.status.in_(ACTIVE_STATUSES)):
+            job_host, _, pid = (job.worker or '').rpartition(':')
+            if job_host == host and pid.isdigit() and not pid_alive(int(pid)):
+                orphaned.append(job)
+        for job in orphaned:
+            job.status = 'failed'
+            job.error = 'interrupted: the process running the job exited'
+            job.finished_at = utcnow()
+        if orphaned:
+            db.session.commit()
+
+    def submit(self, kind, params=None):
+        # Persists a queued job and schedules it; returns the Job
+        if kind not in JOB_HANDLERS:
+            raise ValueError(f"unknown job kind {kind}; expected one of {', '.join(sorted(JOB_HANDLERS))}")
+        params = params or {}
+        if not isinstance(params, dict):
+            raise ValueError("params must be an object")
+        job = Job(kind=kind, status='queued', params=json.dumps(params), worker=worker_name(), created_at=utcnow())
+        db.session.add(job)
+        db.session.commit()
+        self.executor().submit(self.run, job.id)
+        return job
+
+    def cancel(self, job_id):
+        # Queued jobs are cancelled outright; running ones stop at their next check_cancelled().
+        # Returns the job, or None if it does not exist.
+        job = db.session.get(Job, job_id)
+        if job is None:
+            return None
+        if job.status in ACTIVE_STATUSES:
+            # conditional, so a job that finished since it was read keeps cancel_requested unset
+            db.session.execute(db.update(Job).where(Job.id == job_id, Job.status.in_(ACTIVE_STATUSES)).values(cancel_requested=True))
+            db.session.execute(
+                db.update(Job).where(Job.id == job_id, Job.status == 'queued').values(status='cancelled', finished_at=utcnow())
+            )
+            db.session.commit()
+            db.session.refresh(job)
+        return job
+
+    def run(self, job_id):
+        with self.app.app_context():
+            # claim the job unless it was cancelled while queued
+            claimed = db.session.execute(
+                db.update(Job).where(Job.id == job_id, Job.status == 'queued').values(status='running', started_at=utcnow(), progress=0.0)
+            ).rowcount
+            db.session.commit()
+            if not claimed:
+                return
+            job = db.session.get(Job, job_id)
+            context = JobContext(job_id)
+            status, result, error = 'succeeded', None, None
+            try:
+                result = JOB_HANDLERS[job.kind](context, **json.loads(job.params))
+            except JobCancelled:
+                status = 'cancelled'
+            except Exception as e:
+                status, error = 'failed', f'{type(e).__name__}: {e}'
+            db.session.rollback()
+            values = {'result': json.dumps(result, default=str) if result is not None else None, 'error': error, 'finished_at': utcnow()}
+            finish = db.update(Job).where(Job.id == job_id)
+            if status == 'succeeded':
+                # Cancel checks are throttled, so a cancel can land after the handler's last check.
+                # The job only succeeds if no cancel was requested; otherwise it is marked cancelled,
+                # keeping the result of the work it had already committed.
+                succeeded = db.session.execute(finish.filter_by(cancel_requested=False).values(status='succeeded', progress=1.0, **values)).rowcount
+                if not succeeded:
+                    status = 'cancelled'
+                    values['message'] = 'cancel requested as the job finished; its work was already committed'
+            if status != 'succeeded':
+                db.session.execute(finish.values(status=status, **values))
+            db.session.commit()
+
+def init_job_queue(app):
+    app.extensions['job_queue'] = JobQueue(app)
+
+def get_job_queue():
+    return current_app.extensions['job_queue']
+
+# the current app's JobQueue
+job_queue = LocalProxy(get_job_queue)
+
+# Job kinds
+
+@job_handler('billing_data_import')
+def import_billing_data_job(context, path, format, batch_size=DEFAULT_BATCH_SIZE):
+    # path is a spooled upload owned by the job, removed once the import ends
+    size = os.path.getsize(path)
+    try:
+        with open(path, 'rb') as stream:
+            def on_batch(report):
+                context.progress(stream.tell() / size if size else None, f"{report['rows']} rows imported")
+                context.check_cancelled()
+            report = bulk_upsert_billing_data(iter_records(stream, format), batch_size, on_batch)
+    finally:
+        os.remove(path)
+    # a cancel surfaces inside the import as its "error"; batches committed before it stay
+    context.check_cancelled()
+    if 'error' in report:
+        raise RuntimeError(report['error'])
+    return report
+
+@job_handler('rate_card_import')
+def import_rate_card_job(context, entries):
+    try:
+        add_rate_card_entries(entries)
+    except KeyError as e:
+        raise ValueError(f"rate card entry missing {e}")
+    return {'entries': len(entries)}
+
+@job_handler('rebuild_rollups')
+def rebuild_rollups_job(context, dimensions=None):
+    dimensions = dimensions or ROLLUP_DIMENSIONS
+    for i, dimension in enumerate(dimensions):
+        context.check_cancelled()
+        rebuild_rollups([dimension])
+        db.session.commit()
+        context.progress((i + 1) / len(dimensions), f"{dimension} rebuilt", force=True)
+    return {'dimensions': dimensions}
+
+@job_handler('resource_estimates')
+def resource_estimates_job(context, group_by='resource_name', **filters):
+    return aggregate_costs(parse_group_by(group_by, default=['resource_name']), **parse_filters(filters))
+
+@job_handler('reprice')
+def reprice_job(context, run_id=None, period_from=None, period_to=None, sku_ids=None, as_of=None, by_period=False,
+                partition_size=DEFAULT_PARTITION_SIZE, workers=None):
+    # a cancelled reprice leaves its run resumable: submit again with {"run_id": ...}
+    if run_id is None:
+        run_id = create_run(period_from, period_to, sku_ids, None, partition_size, as_of, by_period).id
+        context.progress(0.0, f"planned reprice run {run_id}", force=True)
+
+    def report(progress, seconds):
+        fraction = progress['charges_done'] / progress['charges'] if progress['charges'] else 1.0
+        context.progress(fraction, f"run {run_id}: {progress['charges_done']}/{progress['charges']} charges, {progress['charges_changed']} changed")
+        context.check_cancelled()
+
+    return reprice(run_id, workers, progress=report)
+
+@job_handler('allocate')
+def allocate_job(context, months=None):
+    return run_allocations(months)
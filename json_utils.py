@@ -0,0 +1,42 @@
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson options reproducing the default provider's output: sorted keys, str() of non-str keys,
+# and dates/dataclasses left to DefaultJSONProvider.default so they render as before
+ORJSON_OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+                  | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_PASSTHROUGH_SUBCLASS) if orjson is not None else 0
+
+class FastJSONProvider(DefaultJSONProvider):
+    # Encodes with orjson when it is installed, falling back to the stdlib encoder for anything
+    # orjson rejects (e.g. ints beyond 64 bits) or for custom dumps arguments. The decoded JSON is
+    # the same; only the spelling differs in places: non-ASCII text is UTF-8 rather than \u escapes,
+    # exponents drop the '+' (1e16), and NaN/inf become null instead of invalid NaN tokens.
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or set(kwargs) - {'separators', 'indent'}:
+            return super().dumps(obj, **kwargs)
+        option = ORJSON_OPTIONS | (orjson.OPT_INDENT_2 if kwargs.get('indent') else 0)
+        try:
+            return orjson.dumps(obj, default=self.default, option=option).decode()
+        except (orjson.JSONEncodeError, TypeError):
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # same as DefaultJSONProvider.response, minus the str round trip for the body
+        obj = self._prepare_response_obj(args, kwargs)
+        if orjson is None or (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(obj)
+        try:
+            body = orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS | orjson.OPT_APPEND_NEWLINE)
+        except (orjson.JSONEncodeError, TypeError):
+            return super().response(obj)
+        return self._app.response_class(body, mimetype=self.mimetype)
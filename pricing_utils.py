@@ -0,0 +1,141 @@
+import numpy as np
+from db_utils import db, RateCard, parse_billing_period
+
+# interval lookups search one sorted array of sku_position * KEY_STRIDE + day ordinal
+KEY_STRIDE = 1 << 32
+OPEN_ENDED = np.iinfo(np.int64).max
+# engines built by PriceHistory.engine_at kept per snapshot
+MAX_CACHED_ENGINES = 256
+
+class PricingError(Exception):
+    pass
+
+class PricingEngine:
+    # Rate card held as parallel NumPy arrays, indexed by position in sku_ids
+
+    def __init__(self, sku_ids, pricing_quantities, unit_prices):
+        self.sku_ids = list(sku_ids)
+        self.sku_index = {sku_id: i for i, sku_id in enumerate(self.sku_ids)}
+        self.pricing_quantity = np.asarray(pricing_quantities, dtype=np.float64)
+        self.unit_price = np.asarray(unit_prices, dtype=np.float64)
+        # price of a single usage unit, so pricing is one multiply per charge
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.price_per_unit = np.where(self.pricing_quantity > 0, self.unit_price / self.pricing_quantity, 0.0)
+
+    @classmethod
+    def from_db(cls):
+        rows = db.session.query(RateCard.sku_id, RateCard.pricing_quantity, RateCard.unit_price).all()
+        return cls([r.sku_id for r in rows], [r.pricing_quantity for r in rows], [r.unit_price for r in rows])
+
+    def lookup(self, sku_ids):
+        # Map SKU ids to their array index, -1 for SKUs missing from the rate card
+        index = self.sku_index
+        return np.fromiter((index.get(sku_id, -1) for sku_id in sku_ids), dtype=np.intp, count=len(sku_ids))
+
+    def price(self, sku_index, usage):
+        # usage / pricing_quantity * unit_price for every (sku, usage) pair at once
+        usage = np.asarray(usage, dtype=np.float64)
+        return usage * self.price_per_unit[sku_index]
+
+    def price_scenarios(self, scenarios):
+        # scenarios: list of {sku_id: usage}; returns per-scenario estimates, totals and unknown SKUs
+        sku_ids = []
+        usage = []
+        counts = []
+        for usage_data in scenarios:
+            if not isinstance(usage_data, dict):
+                raise PricingError("each scenario must be an object of sku_id to usage")
+            sku_ids.extend(usage_data.keys())
+            usage.extend(usage_data.values())
+            counts.append(len(usage_data))
+        try:
+            usage = np.asarray(usage, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise PricingError("usage values must be numbers")
+        sku_index = self.lookup(sku_ids)
+        known = sku_index >= 0
+        costs = np.zeros(len(sku_ids))
+        costs[known] = self.price(sku_index[known], usage[known])
+        scenario_index = np.repeat(np.arange(len(scenarios)), counts)
+        totals = np.bincount(scenario_index, weights=costs, minlength=len(scenarios))
+
+        results = []
+        start = 0
+        costs = costs.tolist()
+        known = known.tolist()
+        for count, total in zip(counts, totals.tolist()):
+            end = start + count
+            results.append({
+                "estimates": {sku_ids[i]: costs[i] for i in range(start, end) if known[i]},
+                "total": total,
+                "unknown_sku_ids": [sku_ids[i] for i in range(start, end) if not known[i]],
+            })
+            start = end
+        return results
+
+def day_ordinals(dates):
+    # 'YYYYMMDD' strings or dates -> day ordinals; billing runs repeat few distinct dates
+    cache = {}
+    ordinals = np.empty(len(dates), dtype=np.int64)
+    for i, value in enumerate(dates):
+        day = cache.get(value)
+        if day is None:
+            day = cache[value] = parse_billing_period(value).toordinal()
+        ordinals[i] = day
+    return ordinals
+
+class PriceHistory:
+    # Effective-dated rate card: intervals [valid_from, valid_to) sorted by (sku, valid_from) in
+    # NumPy arrays. One price is a binary search; a batch of (sku, date) pairs is one searchsorted.
+
+    def __init__(self, entries):
+        self.entries = sorted(entries, key=lambda e: (e['sku_id'], parse_billing_period(e['valid_from'])))
+        self.sku_position = {}
+        for entry in self.entries:
+            self.sku_position.setdefault(entry['sku_id'], len(self.sku_position))
+        self.sku = np.array([self.sku_position[e['sku_id']] for e in self.entries], dtype=np.int64)
+        self.valid_from = day_ordinals([e['valid_from'] for e in self.entries])
+        self.valid_to = np.array([parse_billing_period(e['valid_to']).toordinal() if e.get('valid_to') else OPEN_ENDED for e in self.entries], dtype=np.int64)
+        self.keys = self.sku * KEY_STRIDE + self.valid_from
+        pricing_quantity = np.array([e['pricing_quantity'] for e in self.entries], dtype=np.float64)
+        unit_price = np.array([e['unit_price'] for e in self.entries], dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.price_per_unit = np.where(pricing_quantity > 0, unit_price / pricing_quantity, 0.0)
+        self._engines = {}
+
+    def lookup(self, sku_ids, dates):
+        # Interval index in effect for every (sku_id, date) pair, -1 where the SKU had no price
+        sku = np.fromiter((self.sku_position.get(sku_id, -1) for sku_id in sku_ids), dtype=np.int64, count=len(sku_ids))
+        days = day_ordinals(dates)
+        position = np.searchsorted(self.keys, sku * KEY_STRIDE + days, side='right') - 1
+        found = (sku >= 0) & (position >= 0)
+        position = np.where(found, position, 0)
+        if len(self.entries):
+            found &= (self.sku[position] == sku) & (days < self.valid_to[position])
+        else:
+            found[:] = False
+        return np.where(found, position, -1)
+
+    def price(self, interval_index, usage):
+        return np.asarray(usage, dtype=np.float64) * self.price_per_unit[interval_index]
+
+    def entry_at(self, sku_id, as_of):
+        index = self.lookup([sku_id], [as_of])[0]
+        return self.entries[index] if index >= 0 else None
+
+    def entries_at(self, as_of):
+        day = parse_billing_period(as_of).toordinal()
+        in_effect = (self.valid_from <= day) & (day < self.valid_to)
+        return [self.entries[i] for i in np.flatnonzero(in_effect)]
+
+    def engine_at(self, as_of):
+        # PricingEngine over the rates in effect on as_of, shared between requests for the same day
+        day = parse_billing_period(as_of).toordinal()
+        engine = self._engines.get(day)
+        if engine is None:
+            entries = self.entries_at(as_of)
+            engine = PricingEngine([e['sku_id'] for e in entries], [e['pricing_quantity'] for e in entries], [e['unit_price'] for e in entries])
+            if len(self._engines) >= MAX_CACHED_ENGINES:
+                self._engines.clear()
+            self._engines[day] = engine
+        return engine
@@ -0,0 +1,211 @@
+import cProfile
+import io
+import marshal
+import pstats
+import threading
+import time
+
+from flask import current_app, g, has_request_context, make_response, request
+from flask.json.provider import JSONProvider
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Opt-in per-request instrumentation: DB time, query count, rows fetched, JSON serialization time
+# and response size, reported as a Server-Timing header and aggregated for GET /metrics.
+# Sending "X-Profile: 1" (or "raw" for a marshalled pstats dump) replaces that one response with
+# a cProfile report of the request. Metrics are per process; scrape every gunicorn worker.
+
+# upper bounds, in seconds, of the request duration histogram buckets
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_seconds = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.serialize_seconds = 0.0
+
+def current_stats():
+    return g.get('request_stats') if has_request_context() else None
+
+class CountingCursor:
+    # DBAPI cursor proxy counting the rows SQLAlchemy fetches from it
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._stats.rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._stats.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._stats.rows += len(rows)
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_stats() is not None:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_stats()
+    if stats is None or not conn.info.get('query_started'):
+        return
+    stats.db_seconds += time.perf_counter() - conn.info['query_started'].pop()
+    stats.queries += 1
+    if context is not None and cursor.description is not None:
+        # the result is built from context.cursor right after this hook
+        context.cursor = CountingCursor(cursor, stats)
+
+class TimedJSONProvider(JSONProvider):
+    # Wraps the app's JSON provider so jsonify time is attributed to serialization
+    def __init__(self, app, provider):
+        super().__init__(app)
+        self.provider = provider
+
+    def dumps(self, obj, **kwargs):
+        return self.provider.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return self.provider.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self.provider.response(*args, **kwargs)
+        finally:
+            stats = current_stats()
+            if stats is not None:
+                stats.serialize_seconds += time.perf_counter() - started
+
+class RequestMetrics:
+    # Process-wide counters and histograms keyed by (endpoint, method, status)
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, labels, stats, seconds, response_bytes):
+        with self._lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = {'count': 0, 'seconds': 0.0, 'db_seconds': 0.0, 'queries': 0, 'rows': 0,
+                                                 'serialize_seconds': 0.0, 'response_bytes': 0, 'buckets': [0] * len(DURATION_BUCKETS)}
+            series['count'] += 1
+            series['seconds'] += seconds
+            series['db_seconds'] += stats.db_seconds
+            series['queries'] += stats.queries
+            series['rows'] += stats.rows
+            series['serialize_seconds'] += stats.serialize_seconds
+            series['response_bytes'] += response_bytes
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    series['buckets'][i] += 1
+
+    def render(self):
+        # Prometheus text exposition format
+        counters = [
+            ('gptbma_request_db_seconds_total', 'db_seconds', 'Time spent executing SQL'),
+            ('gptbma_request_queries_total', 'queries', 'SQL statements executed'),
+            ('gptbma_request_rows_total', 'rows', 'Rows fetched from the database'),
+            ('gptbma_request_serialize_seconds_total', 'serialize_seconds', 'Time spent serializing JSON responses'),
+            ('gptbma_response_bytes_total', 'response_bytes', 'Response body bytes, after compression'),
+        ]
+        with self._lock:
+            series = sorted(self.series.items())
+            lines = ['# HELP gptbma_request_duration_seconds Request duration', '# TYPE gptbma_request_duration_seconds histogram']
+            for (endpoint, method, status), values in series:
+                labels = f'endpoint="{endpoint}",method="{method}",status="{status}"'
+                for bound, count in zip(DURATION_BUCKETS, values['buckets']):
+                    lines.append(f'gptbma_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'gptbma_request_duration_seconds_bucket{{{labels},le="+Inf"}} {values["count"]}')
+                lines.append(f'gptbma_request_duration_seconds_sum{{{labels}}} {values["seconds"]:.6f}')
+                lines.append(f'gptbma_request_duration_seconds_count{{{labels}}} {values["count"]}')
+            for name, key, help_text in counters:
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                for (endpoint, method, status), values in series:
+                    lines.append(f'{name}{{endpoint="{endpoint}",method="{method}",status="{status}"}} {values[key]}')
+        return '\n'.join(lines) + '\n'
+
+def profile_requested():
+    token = current_app.config['PROFILING_TOKEN']
+    if token and request.headers.get('X-Profile-Token') != token:
+        return False
+    return request.headers.get('X-Profile', '').lower() in ('1', 'true', 'raw')
+
+def start_request():
+    g.request_stats = RequestStats()
+    if profile_requested():
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+def profile_response(profiler):
+    profiler.disable()
+    stats = pstats.Stats(profiler)
+    if request.headers.get('X-Profile', '').lower() == 'raw':
+        # load with pstats.Stats after marshal.loads, or open in snakeviz
+        response = make_response(marshal.dumps(stats.stats))
+        response.mimetype = 'application/octet-stream'
+        return response
+    out = io.StringIO()
+    stats.stream = out
+    stats.sort_stats('cumulative').print_stats(current_app.config['PROFILING_TOP'])
+    response = make_response(out.getvalue())
+    response.mimetype = 'text/plain'
+    return response
+
+def finish_request(response):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return response
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        original_status = response.status_code
+        response = profile_response(profiler)
+        response.headers['X-Profile-Status'] = str(original_status)
+    seconds = time.perf_counter() - stats.started
+    app_seconds = max(seconds - stats.db_seconds - stats.serialize_seconds, 0.0)
+    response.headers['Server-Timing'] = ', '.join([
+        f'db;dur={stats.db_seconds * 1000:.2f};desc="{stats.queries} queries, {stats.rows} rows"',
+        f'serialize;dur={stats.serialize_seconds * 1000:.2f}',
+        f'app;dur={app_seconds * 1000:.2f}',
+        f'total;dur={seconds * 1000:.2f}',
+    ])
+    # streamed exports have no length up front; their bytes are not counted
+    response_bytes = response.content_length or 0
+    if request.endpoint != 'metrics':
+        current_app.extensions['request_metrics'].observe((request.endpoint or 'unmatched', request.method, response.status_code), stats, seconds, response_bytes)
+    return response
+
+def metrics():
+    response = make_response(current_app.extensions['request_metrics'].render())
+    response.mimetype = 'text/plain'
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+def init_profiling(app):
+    # Call before init_compression: after_request hooks run in reverse order, so finish_request
+    # then sees the final (compressed) response size
+    app.config.setdefault('PROFILING_ENABLED', False)
+    app.config.setdefault('PROFILING_TOKEN', None)
+    app.config.setdefault('PROFILING_TOP', 50)
+    if not app.config['PROFILING_ENABLED']:
+        return
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    app.extensions['request_metrics'] = RequestMetrics()
+    app.json = TimedJSONProvider(app, app.json)
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics, methods=['GET'])
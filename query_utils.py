@@ -0,0 +1,88 @@
+from db_utils import db, BillingData, parse_billing_period
+
+BILLING_DATA_FIELDS = ['charge_id', 'sku_id', 'service_offering', 'billing_period_start', 'billing_period_end', 'resource_name', 'resource_type', 'usage_unit', 'usage_quantity']
+
+# Equality filters accepted by GET /api/billing_data
+BILLING_DATA_FILTERS = ['sku_id', 'resource_name', 'resource_type', 'service_offering']
+
+def parse_fields(value, allowed):
+    # "sku_id,usage_quantity" -> ['sku_id', 'usage_quantity'], in the order given
+    if not value:
+        return list(allowed)
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in allowed]
+    if unknown:
+        raise ValueError(f"unknown fields {', '.join(unknown)}; expected any of {', '.join(allowed)}")
+    return fields
+
+def filter_billing_data(query, args):
+    # Applies the equality filters and the period_from/period_to range on billing_period_start
+    for name in BILLING_DATA_FILTERS:
+        value = args.get(name)
+        if value:
+            query = query.where(getattr(BillingData, name) == value)
+    # raises ValueError for a malformed period
+    if args.get('period_from'):
+        query = query.where(BillingData.billing_period_start >= parse_billing_period(args['period_from']))
+    if args.get('period_to'):
+        query = query.where(BillingData.billing_period_start <= parse_billing_period(args['period_to']))
+    return query
+
+def billing_data_select(args, fields):
+    # Core select of the projected columns, filtered and in charge_id order, for streaming exports
+    query = filter_billing_data(db.select(*[getattr(BillingData, name) for name in fields]), args)
+    return query.order_by(BillingData.charge_id)
+
+def is_filtered(args):
+    return any(args.get(name) for name in BILLING_DATA_FILTERS + ['period_from', 'period_to'])
+
+def parse_page_cursor(after):
+    # 'YYYYMMDD:charge_id' -> (billing_period_start, charge_id)
+    period, sep, charge_id = after.partition(':')
+    if not sep:
+        raise ValueError(f"invalid cursor {after!r}; expected YYYYMMDD:charge_id for a filtered page")
+    return parse_billing_period(period), charge_id
+
+def billing_data_page_query(args, fields, limit, after=None):
+    # Keyset pagination without OFFSET, each page one index range scan in index order. Unfiltered
+    # pages walk the primary key, keyed on charge_id. Filtered pages walk the filter column's (or
+    # the period) index, so they are ordered and keyed on (billing_period_start, charge_id) and
+    # their cursor is 'YYYYMMDD:charge_id'; ordering on charge_id alone would sort every match.
+    # Fetches one extra row to tell whether there is a next page; billing_period_start and
+    # charge_id are always the last two columns. Raises ValueError for a malformed cursor.
+    columns = [getattr(BillingData, name) for name in fields] + [BillingData.billing_period_start, BillingData.charge_id]
+    if not is_filtered(args):
+        query = db.select(*columns)
+        if after:
+            query = query.where(BillingData.charge_id > after)
+        return query.order_by(BillingData.charge_id).limit(limit + 1)
+    cursor = None
+    if after:
+        cursor = parse_page_cursor(after)
+        if args.get('period_from') and parse_billing_period(args['period_from']) > cursor[0]:
+            cursor = None
+        else:
+            # the cursor is the tighter lower bound; with both, SQLite seeks on period_from and
+            # walks every earlier page again
+            args = {name: value for name, value in args.items() if name != 'period_from'}
+    query = filter_billing_data(db.select(*columns), args)
+    if cursor:
+        # a row-value comparison, which the index can seek to; the equivalent OR of two
+        # conditions makes SQLite walk the index from the start of the range
+        query = query.where(db.tuple_(BillingData.billing_period_start, BillingData.charge_id) > cursor)
+    return query.order_by(BillingData.billing_period_start, BillingData.charge_id).limit(limit + 1)
+
+def billing_data_page(args, fields, limit, after=None):
+    # Returns (rows as dicts, cursor for the next page or None); executed on the session's
+    # connection so rows come back as plain Core tuples without the ORM loading layer
+    rows = db.session.connection().execute(billing_data_page_query(args, fields, limit, after)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        period, charge_id = rows[limit - 1][-2:]
+        next_cursor = f'{period}:{charge_id}' if is_filtered(args) else charge_id
+    return [dict(zip(fields, row)) for row in rows[:limit]], next_cursor
+
+def billing_data_charge(charge_id, fields):
+    # One charge as a dict of fields, or None
+    row = db.session.connection().execute(db.select(*[getattr(BillingData, name) for name in fields]).where(BillingData.charge_id == charge_id)).first()
+    return dict(zip(fields, row)) if row is not None else None
@@ -0,0 +1,71 @@
+from datetime import datetime, timezone
+
+from db_utils import db, RateCard, RateCardHistory, parse_billing_period, bump_table_version
+from cache_utils import RATE_CARD_FIELDS, rate_card_cache
+from rollup_utils import UNCATEGORIZED, move_sku_categories
+
+# SKUs that predate the history table are treated as priced the same since this day
+HISTORY_EPOCH = '19700101'
+
+def today():
+    return datetime.now(timezone.utc).date()
+
+def effective_date(value):
+    # valid_from of a rate card write: today by default, or a past date to backdate the change
+    if not value:
+        return today()
+    day = parse_billing_period(value)
+    if day > today():
+        raise ValueError("valid_from cannot be in the future")
+    return day
+
+def open_version(sku_id):
+    return RateCardHistory.query.filter_by(sku_id=sku_id, valid_to=None).first()
+
+def close_rate_card_version(sku_id, valid_to):
+    # Ends the SKU's open interval at valid_to; an interval starting that same day never took
+    # effect and is dropped. Caller commits.
+    current = open_version(sku_id)
+    if current is None:
+        return
+    valid_from = parse_billing_period(current.valid_from)
+    if valid_from > valid_to:
+        raise ValueError(f"{sku_id} has a price from {current.valid_from}; the change must not predate it")
+    if valid_from == valid_to:
+        db.session.delete(current)
+    else:
+        current.valid_to = valid_to
+
+def record_rate_card_version(entry, valid_from):
+    # Opens a new interval for entry (a rate card dict) from valid_from, closing the previous one.
+    # A second change on the same valid_from replaces that interval. Caller commits.
+    current = open_version(entry['sku_id'])
+    if current is not None and parse_billing_period(current.valid_from) == valid_from:
+        for field in RATE_CARD_FIELDS:
+            setattr(current, field, entry[field])
+        return
+    close_rate_card_version(entry['sku_id'], valid_from)
+    db.session.add(RateCardHistory(valid_from=valid_from, valid_to=None, **{field: entry[field] for field in RATE_CARD_FIELDS}))
+
+def ensure_rate_card_history():
+    # Backfills an open interval for every RateCard row without any history, e.g. rows from before it
+    with_history = db.select(RateCardHistory.sku_id)
+    missing = RateCard.query.filter(RateCard.sku_id.not_in(with_history)).all()
+    if not missing:
+        return
+    for entry in missing:
+        db.session.add(RateCardHistory(valid_from=HISTORY_EPOCH, valid_to=None, **{field: getattr(entry, field) for field in RATE_CARD_FIELDS}))
+    bump_table_version('rate_card')
+    db.session.commit()
+
+def add_rate_card_entries(entries):
+    # Creates RateCard rows, each with its history interval, in one transaction. Raises KeyError
+    # for a missing field and ValueError for a bad valid_from; the caller rolls back.
+    for obj in entries:
+        db.session.add(RateCard(**{field: obj[field] for field in RATE_CARD_FIELDS}))
+        record_rate_card_version(obj, effective_date(obj.get('valid_from')))
+    bump_table_version('rate_card')
+    # charges of the new SKUs were uncategorized until now
+    move_sku_categories({obj['sku_id']: (UNCATEGORIZED, obj['service_category']) for obj in entries})
+    db.session.commit()
+    rate_card_cache.rebuild()
@@ -0,0 +1,238 @@
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+from sqlalchemy import create_engine
+
+from db_utils import db, BillingData, RepriceRun, RepricePartition, bump_table_version, is_sqlite_memory, parse_billing_period
+from pricing_utils import PricingEngine, PriceHistory
+from query_utils import filter_billing_data
+from rollup_utils import RollupDeltas, UNCATEGORIZED
+from cache_utils import RATE_CARD_FIELDS, RATE_CARD_HISTORY_FIELDS, rate_card_cache
+
+# Recomputes BillingData.effective_cost as usage_quantity / pricing_quantity * unit_price.
+# A run is planned into partitions (one billing period, a range of resource names, about
+# partition_size charges each) stored in reprice_partition. Worker processes read and price
+# partitions; the parent writes each one back in its own transaction together with its rollup
+# deltas and the partition's done flag, so an interrupted run resumes where it stopped.
+
+DEFAULT_PARTITION_SIZE = 20000
+# stored costs are in cents
+COST_DECIMALS = 2
+
+class RepriceError(Exception):
+    pass
+
+# per-process state set by init_worker
+_worker = {}
+
+def worker_state(engine, rate_card, categories, sku_ids, by_period=False):
+    # engine is a database URI in pool workers, or the app's engine when pricing inline.
+    # With by_period, rate_card holds history intervals and each partition is priced as of its period.
+    if isinstance(engine, str):
+        engine = create_engine(engine)
+    state = {'engine': engine, 'categories': categories, 'sku_ids': sku_ids}
+    if by_period:
+        state['history'] = PriceHistory(rate_card)
+    else:
+        state['pricing'] = PricingEngine([e['sku_id'] for e in rate_card], [e['pricing_quantity'] for e in rate_card], [e['unit_price'] for e in rate_card])
+    return state
+
+def init_worker(*args):
+    _worker.update(worker_state(*args))
+
+def partition_select(billing_period_start, first_resource, last_resource, sku_ids):
+    table = BillingData.__table__
+    query = (
+        db.select(table.c.charge_id, table.c.resource_name, table.c.resource_type, table.c.sku_id, table.c.usage_quantity, table.c.effective_cost)
+        .where(table.c.billing_period_start == billing_period_start)
+        .where(table.c.resource_name.between(first_resource, last_resource))
+    )
+    if sku_ids:
+        query = query.where(table.c.sku_id.in_(sku_ids))
+    return query
+
+def price_partition(partition, worker=None):
+    # Runs in a worker: prices one partition's charges in one vectorized pass and returns only
+    # the changed costs plus their summed cost change per rollup key. Inline callers pass their
+    # own worker state, since several reprices may run on job queue threads at once.
+    worker = _worker if worker is None else worker
+    partition_no, billing_period_start, first_resource, last_resource = partition
+    with worker['engine'].connect() as conn:
+        rows = conn.execute(partition_select(billing_period_start, first_resource, last_resource, worker['sku_ids'])).all()
+    if not rows:
+        return partition_no, [], [], [], 0, 0
+    charge_ids, resource_names, resource_types, sku_ids, usage, old_costs = zip(*rows)
+    pricing = worker['history'].engine_at(billing_period_start) if 'history' in worker else worker['pricing']
+    sku_index = pricing.lookup(sku_ids)
+    priced = sku_index >= 0
+    old_costs = np.array([np.nan if cost is None else cost for cost in old_costs], dtype=np.float64)
+    new_costs = old_costs.copy()
+    new_costs[priced] = np.round(pricing.price(sku_index[priced], np.asarray(usage, dtype=np.float64)[priced]), COST_DECIMALS)
+    changed = priced & ~(new_costs == old_costs)
+    diff = new_costs[changed] - np.nan_to_num(old_costs[changed])
+
+    deltas = []
+    if changed.any():
+        categories = worker['categories']
+        keys = {
+            'resource_name': np.asarray(resource_names, dtype=object)[changed],
+            'resource_type': np.asarray(resource_types, dtype=object)[changed],
+            'sku_id': np.asarray(sku_ids, dtype=object)[changed],
+        }
+        keys['service_category'] = np.asarray([categories.get(sku_id, UNCATEGORIZED) for sku_id in keys['sku_id']], dtype=object)
+        for dimension, values in keys.items():
+            unique, inverse = np.unique(values, return_inverse=True)
+            deltas.extend(zip([dimension] * len(unique), unique.tolist(), np.bincount(inverse, weights=diff).tolist()))
+        deltas.append(('billing_month', None, float(diff.sum())))
+    changed_ids = np.asarray(charge_ids, dtype=object)[changed].tolist()
+    return partition_no, changed_ids, new_costs[changed].tolist(), deltas, len(rows), int(priced.sum())
+
+def plan_partitions(filters, sku_ids, partition_size):
+    # Consecutive resource names of each period are packed into partitions of about partition_size charges
+    query = db.select(BillingData.billing_period_start, BillingData.resource_name, db.func.count())
+    query = filter_billing_data(query, filters)
+    if sku_ids:
+        query = query.where(BillingData.sku_id.in_(sku_ids))
+    query = query.group_by(BillingData.billing_period_start, BillingData.resource_name).order_by(BillingData.billing_period_start, BillingData.resource_name)
+    partitions = []
+    current = None
+    for period, resource_name, count in db.session.execute(query):
+        if current is None or current['billing_period_start'] != period or current['charges'] + count > partition_size:
+            current = {'partition_no': len(partitions), 'billing_period_start': period, 'first_resource': resource_name, 'last_resource': resource_name, 'charges': 0}
+            partitions.append(current)
+        current['last_resource'] = resource_name
+        current['charges'] += count
+    return partitions
+
+def create_run(period_from=None, period_to=None, sku_ids=None, rate_card=None, partition_size=DEFAULT_PARTITION_SIZE, as_of=None, by_period=False):
+    # Plans a run against rate_card (a list of rate card entries, or history intervals with
+    # by_period). By default that is the current rate card, the one in effect on as_of, or with
+    # by_period the whole history so each charge gets the rates of its billing period.
+    filters = {'period_from': period_from, 'period_to': period_to, 'as_of': as_of}
+    for value in filters.values():
+        if value:
+            parse_billing_period(value)
+    if rate_card is None:
+        history = rate_card_cache.snapshot.history
+        if by_period:
+            rate_card = history.entries
+        elif as_of:
+            rate_card = history.entries_at(as_of)
+        else:
+            rate_card = rate_card_cache.snapshot.entries
+    required = ('sku_id', 'pricing_quantity', 'unit_price', 'valid_from') if by_period else ('sku_id', 'pricing_quantity', 'unit_price')
+    missing = [field for entry in rate_card for field in required if field not in entry]
+    if not rate_card:
+        raise RepriceError("no rate card prices to reprice against")
+    if missing:
+        raise RepriceError(f"rate card entries need {', '.join(sorted(set(missing)))}")
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    fields = RATE_CARD_HISTORY_FIELDS if by_period else RATE_CARD_FIELDS
+    run = RepriceRun(
+        period_from=period_from, period_to=period_to, sku_ids=','.join(sku_ids) if sku_ids else None,
+        as_of=as_of, by_period=by_period,
+        rate_card=json.dumps([{field: entry.get(field) for field in fields} for entry in rate_card]),
+        created_at=now, updated_at=now,
+    )
+    db.session.add(run)
+    db.session.flush()
+    partitions = plan_partitions(filters, sku_ids, partition_size)
+    db.session.execute(db.insert(RepricePartition), [{'run_id': run.id, **partition} for partition in partitions])
+    run.partitions = len(partitions)
+    run.charges = sum(partition['charges'] for partition in partitions)
+    db.session.commit()
+    return run
+
+def run_progress(run):
+    return {
+        'run_id': run.id, 'status': run.status,
+        'partitions': run.partitions, 'partitions_done': run.partitions_done,
+        'charges': run.charges, 'charges_done': run.charges_done,
+        'charges_changed': run.charges_changed, 'charges_unpriced': run.charges_unpriced,
+    }
+
+def write_partition(run, result, partition, month):
+    # One transaction: repriced costs, rollup deltas, the partition's done flag and run counters.
+    # The partition is claimed first, so when two resumes of the same run price it only one writes
+    # it back; returns False for the other.
+    partition_no, charge_ids, costs, deltas, charges, priced = result
+    claim = (
+        db.update(RepricePartition)
+        .filter_by(run_id=run.id, partition_no=partition_no, done=False)
+        .values(done=True)
+        .execution_options(synchronize_session=False)
+    )
+    if db.session.execute(claim).rowcount == 0:
+        db.session.rollback()
+        return False
+    if charge_ids:
+        table = BillingData.__table__
+        update = table.update().where(table.c.charge_id == db.bindparam('b_charge_id')).values(effective_cost=db.bindparam('b_cost'))
+        db.session.connection().execute(update, [{'b_charge_id': charge_id, 'b_cost': cost} for charge_id, cost in zip(charge_ids, costs)])
+        rollup_deltas = RollupDeltas()
+        for dimension, key, cost in deltas:
+            rollup_deltas.add_cost(dimension, month if dimension == 'billing_month' else key, month, cost)
+        rollup_deltas.apply()
+        bump_table_version('billing_data')
+    # counters are incremented in SQL since another resume may be writing the same run
+    run.partitions_done = RepriceRun.partitions_done + 1
+    run.charges_done = RepriceRun.charges_done + charges
+    run.charges_changed = RepriceRun.charges_changed + len(charge_ids)
+    run.charges_unpriced = RepriceRun.charges_unpriced + charges - priced
+    run.updated_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    db.session.commit()
+    return True
+
+def reprice(run_id, workers=None, progress=None):
+    # Prices every partition of the run not yet done; safe to call again after an interruption.
+    # workers=0 (and in-memory SQLite, which other processes cannot see) prices in this process.
+    run = db.session.get(RepriceRun, run_id)
+    if run is None:
+        raise RepriceError(f"reprice run {run_id} not found")
+    rate_card = json.loads(run.rate_card)
+    # rollups categorize by the live rate card, whichever one the costs are priced against
+    categories = {entry['sku_id']: entry['service_category'] for entry in rate_card_cache.snapshot.entries}
+    sku_ids = run.sku_ids.split(',') if run.sku_ids else None
+    pending = {p.partition_no: p for p in RepricePartition.query.filter_by(run_id=run.id, done=False).order_by(RepricePartition.partition_no)}
+    tasks = [(p.partition_no, parse_billing_period(p.billing_period_start), p.first_resource, p.last_resource) for p in pending.values()]
+    run.status = 'running'
+    db.session.commit()
+
+    uri = str(db.engine.url.render_as_string(hide_password=False))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers and len(tasks) > 1 and not is_sqlite_memory(uri):
+        # spawned, not forked: reprice runs on job queue and request threads, and a fork would copy
+        # whatever locks (and pooled connections) the other threads hold at that moment
+        executor = ProcessPoolExecutor(
+            max_workers=min(workers, len(tasks)), mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker, initargs=(uri, rate_card, categories, sku_ids, run.by_period),
+        )
+        results = executor.map(price_partition, tasks)
+    else:
+        executor = None
+        state = worker_state(db.engine, rate_card, categories, sku_ids, run.by_period)
+        results = (price_partition(task, state) for task in tasks)
+    started = time.monotonic()
+    try:
+        for result in results:
+            partition = pending[result[0]]
+            write_partition(run, result, partition, parse_billing_period(partition.billing_period_start).strftime('%Y%m'))
+            if progress is not None:
+                progress(run_progress(run), time.monotonic() - started)
+    except BaseException:
+        db.session.rollback()
+        run.status = 'interrupted'
+        db.session.commit()
+        raise
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    run.status = 'done'
+    db.session.commit()
+    return run_progress(run)
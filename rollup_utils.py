@@ -0,0 +1,174 @@
+from collections import defaultdict
+
+from db_utils import db, RateCard, BillingData, CostRollup, dialect_insert, parse_billing_period
+from cache_utils import rate_card_cache
+
+ROLLUP_DIMENSIONS = ['resource_name', 'resource_type', 'sku_id', 'service_category', 'billing_month']
+# BillingData columns a charge needs to be rolled up
+ROLLUP_FIELDS = ['charge_id', 'resource_name', 'resource_type', 'sku_id', 'billing_period_start', 'effective_cost']
+UNCATEGORIZED = 'uncategorized'
+
+def billing_month(billing_period_start):
+    return parse_billing_period(billing_period_start).strftime('%Y%m')
+
+def billing_month_expression(column):
+    # SQL for a DATE column's 'YYYYMM'
+    if db.engine.dialect.name == 'postgresql':
+        return db.func.to_char(column, 'YYYYMM')
+    return db.func.strftime('%Y%m', column)
+
+class RollupDeltas:
+    # Accumulates per-(dimension, key, month) cost and count changes for a set of written
+    # charges, then applies them in one executemany upsert inside the caller's transaction
+
+    def __init__(self):
+        self.deltas = defaultdict(lambda: [0.0, 0])
+
+    def add_charge(self, charge, sign=1):
+        month = billing_month(charge['billing_period_start'])
+        cost = (charge['effective_cost'] or 0.0) * sign
+        sku = rate_card_cache.snapshot.get(charge['sku_id'])
+        keys = {
+            'resource_name': charge['resource_name'],
+            'resource_type': charge['resource_type'],
+            'sku_id': charge['sku_id'],
+            'service_category': sku['service_category'] if sku else UNCATEGORIZED,
+            'billing_month': month,
+        }
+        for dimension, key in keys.items():
+            delta = self.deltas[(dimension, key, month)]
+            delta[0] += cost
+            delta[1] += sign
+
+    def add_charges(self, charges, sign=1):
+        for charge in charges:
+            self.add_charge(charge, sign)
+
+    def add_cost(self, dimension, key, month, cost):
+        # a cost change for charges that stay in place, e.g. after repricing
+        self.deltas[(dimension, key, month)][0] += cost
+
+    def move(self, dimension, old_key, new_key, month, cost, count):
+        # charges that stay in place but change key in one dimension
+        self.deltas[(dimension, old_key, month)][0] -= cost
+        self.deltas[(dimension, old_key, month)][1] -= count
+        self.deltas[(dimension, new_key, month)][0] += cost
+        self.deltas[(dimension, new_key, month)][1] += count
+
+    def apply(self):
+        rows = [
+            {'dimension': dimension, 'key': key, 'billing_month': month, 'effective_cost': cost, 'charge_count': count}
+            for (dimension, key, month), (cost, count) in self.deltas.items() if count or cost
+        ]
+        if not rows:
+            return
+        db.session.execute(rollup_upsert_statement(), rows)
+        # Drop the rows left without charges. Only keys whose count did not go up can end at zero,
+        # and each is deleted by primary key, so a single-charge write costs no table scan.
+        emptied = [
+            {'b_dimension': row['dimension'], 'b_key': row['key'], 'b_billing_month': row['billing_month']}
+            for row in rows if row['charge_count'] <= 0
+        ]
+        if emptied:
+            table = CostRollup.__table__
+            delete = table.delete().where(
+                table.c.dimension == db.bindparam('b_dimension'), table.c.key == db.bindparam('b_key'),
+                table.c.billing_month == db.bindparam('b_billing_month'), table.c.charge_count <= 0,
+            )
+            db.session.connection().execute(delete, emptied)
+        self.deltas.clear()
+
+def rollup_upsert_statement():
+    stmt = dialect_insert(CostRollup)
+    return stmt.on_conflict_do_update(
+        index_elements=[CostRollup.dimension, CostRollup.key, CostRollup.billing_month],
+        set_={
+            'effective_cost': CostRollup.effective_cost + stmt.excluded.effective_cost,
+            'charge_count': CostRollup.charge_count + stmt.excluded.charge_count,
+        },
+    )
+
+def rollup_key_columns():
+    return {
+        'resource_name': BillingData.resource_name,
+        'resource_type': BillingData.resource_type,
+        'sku_id': BillingData.sku_id,
+        'service_category': db.func.coalesce(RateCard.service_category, UNCATEGORIZED),
+        'billing_month': billing_month_expression(BillingData.billing_period_start),
+    }
+
+def rebuild_rollups(dimensions=ROLLUP_DIMENSIONS):
+    # Recomputes the given dimensions from billing_data with one INSERT ... SELECT GROUP BY each.
+    # Used for backfills and repairs; rate card changes use move_sku_categories. Caller commits.
+    key_columns = rollup_key_columns()
+    month = billing_month_expression(BillingData.billing_period_start)
+    for dimension in dimensions:
+        key = key_columns[dimension]
+        select = (
+            db.select(
+                db.literal(dimension), key, month,
+                db.func.coalesce(db.func.sum(BillingData.effective_cost), 0.0), db.func.count(),
+            )
+            .select_from(BillingData)
+            .outerjoin(RateCard, RateCard.sku_id == BillingData.sku_id)
+            .group_by(key, month)
+        )
+        db.session.execute(db.delete(CostRollup).where(CostRollup.dimension == dimension))
+        db.session.execute(db.insert(CostRollup).from_select(['dimension', 'key', 'billing_month', 'effective_cost', 'charge_count'], select))
+
+def move_sku_categories(moves):
+    # moves: {sku_id: (old service_category, new service_category)}, with UNCATEGORIZED for a SKU
+    # without a rate card entry. Each SKU's charges are already summed per month under the sku_id
+    # dimension, so its totals move between category keys without reading billing_data. Caller commits.
+    moves = {sku_id: (old, new) for sku_id, (old, new) in moves.items() if old != new}
+    if not moves:
+        return
+    totals = db.session.execute(
+        db.select(CostRollup.key, CostRollup.billing_month, CostRollup.effective_cost, CostRollup.charge_count)
+        .where(CostRollup.dimension == 'sku_id', CostRollup.key.in_(moves))
+    )
+    deltas = RollupDeltas()
+    for sku_id, month, cost, count in totals:
+        old, new = moves[sku_id]
+        deltas.move('service_category', old, new, month, cost, count)
+    deltas.apply()
+
+def query_rollups(dimension, key=None, billing_month=None, by_month=True, group=None, limit=None):
+    # Reads pre-summed costs: O(groups), never touches billing_data. group keeps the key itself and
+    # the keys under it (app_1 -> app_1, app_1_vm_1, ... but not app_10_*); limit returns only the
+    # costliest rows.
+    if dimension not in ROLLUP_DIMENSIONS:
+        raise ValueError(f"unknown dimension {dimension}; expected one of {', '.join(ROLLUP_DIMENSIONS)}")
+    rollup = CostRollup
+    if group is not None:
+        # the key itself and the range of keys starting with group + '_' ('`' sorts right after
+        # '_'), as two index searches; a single OR makes SQLite search on the dimension alone
+        in_dimension = db.select(CostRollup).where(CostRollup.dimension == dimension)
+        rollup = db.aliased(CostRollup, db.union_all(
+            in_dimension.where(CostRollup.key == group),
+            in_dimension.where(CostRollup.key >= group + '_', CostRollup.key < group + '`'),
+        ).subquery())
+    columns = [rollup.key]
+    if by_month:
+        columns.append(rollup.billing_month)
+    query = db.select(*columns, db.func.sum(rollup.effective_cost).label('effective_cost'), db.func.sum(rollup.charge_count).label('charge_count'))
+    query = query.where(rollup.dimension == dimension)
+    if key is not None:
+        query = query.where(rollup.key == key)
+    if billing_month is not None:
+        query = query.where(rollup.billing_month == billing_month)
+    query = query.group_by(*columns)
+    if limit is not None:
+        query = query.order_by(db.desc('effective_cost'), *columns).limit(limit)
+    else:
+        query = query.order_by(*columns)
+    result = db.session.connection().execute(query)
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
+def ensure_rollups():
+    # Backfills the rollups of a database that has charges but predates them
+    if db.session.query(CostRollup.query.exists()).scalar() or not db.session.query(BillingData.query.exists()).scalar():
+        return
+    rebuild_rollups()
+    db.session.commit()
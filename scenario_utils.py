@@ -0,0 +1,92 @@
+import numpy as np
+
+from db_utils import db, BillingData
+from query_utils import filter_billing_data
+from pricing_utils import PricingError
+
+def parse_scenarios(scenarios):
+    # Accepts [{sku_id: usage}, ...] or [{"name": ..., "overrides": {sku_id: usage}}, ...]
+    if not isinstance(scenarios, list) or not scenarios:
+        raise PricingError("scenarios must be a non-empty list")
+    parsed = []
+    for i, scenario in enumerate(scenarios):
+        if not isinstance(scenario, dict):
+            raise PricingError("each scenario must be an object")
+        name = scenario.get('name', f"scenario_{i + 1}") if 'overrides' in scenario else f"scenario_{i + 1}"
+        overrides = scenario['overrides'] if 'overrides' in scenario else scenario
+        if not isinstance(overrides, dict):
+            raise PricingError("overrides must be an object of sku_id to usage")
+        try:
+            overrides = {sku_id: float(usage) for sku_id, usage in overrides.items()}
+        except (TypeError, ValueError):
+            raise PricingError("usage overrides must be numbers")
+        parsed.append((name, overrides))
+    return parsed
+
+def load_charges(resources=None, resource_prefix=None, filters=None):
+    # Charges of the selected resources as (resource_names, sku_ids, usage, effective_cost) columns
+    query = db.select(BillingData.resource_name, BillingData.sku_id, BillingData.usage_quantity, BillingData.effective_cost)
+    query = filter_billing_data(query, filters or {})
+    if resources:
+        query = query.where(BillingData.resource_name.in_(resources))
+    if resource_prefix:
+        # a range instead of LIKE so the resource_name index is used
+        query = query.where(BillingData.resource_name >= resource_prefix, BillingData.resource_name < resource_prefix + '\U0010ffff')
+    rows = db.session.execute(query).all()
+    if not rows:
+        return [], [], np.zeros(0), np.zeros(0)
+    resource_names, sku_ids, usage, effective_cost = zip(*rows)
+    effective_cost = np.array([c if c is not None else 0.0 for c in effective_cost], dtype=np.float64)
+    return list(resource_names), list(sku_ids), np.asarray(usage, dtype=np.float64), effective_cost
+
+def price_usage_scenarios(engine, resource_names, sku_ids, usage, effective_cost, scenarios):
+    # Prices the baseline usage and every scenario in one pass. Overrides replace the usage of
+    # each charge of that SKU; the result is an (S, N) usage matrix priced with one multiply.
+    resources, resource_index = np.unique(np.asarray(resource_names, dtype=object), return_inverse=True) if resource_names else (np.array([], dtype=object), np.zeros(0, dtype=np.intp))
+    n_skus = len(engine.sku_ids)
+    charge_sku = engine.lookup(sku_ids)
+    # SKUs missing from the rate card price at 0 through an extra trailing slot
+    charge_sku = np.where(charge_sku < 0, n_skus, charge_sku)
+    price_per_unit = np.append(engine.price_per_unit, 0.0)
+
+    overrides = np.full((len(scenarios), n_skus + 1), np.nan)
+    unknown = []
+    for s, (name, scenario) in enumerate(scenarios):
+        missing = []
+        for sku_id, value in scenario.items():
+            k = engine.sku_index.get(sku_id)
+            if k is None:
+                missing.append(sku_id)
+            else:
+                overrides[s, k] = value
+        unknown.append(missing)
+
+    scenario_usage = overrides[:, charge_sku]
+    scenario_usage = np.where(np.isnan(scenario_usage), usage, scenario_usage)
+    baseline_cost = usage * price_per_unit[charge_sku]
+    scenario_cost = scenario_usage * price_per_unit[charge_sku]
+
+    def by_resource(costs):
+        return dict(zip(resources.tolist(), np.bincount(resource_index, weights=costs, minlength=len(resources)).tolist()))
+
+    baseline_total = float(baseline_cost.sum())
+    totals = scenario_cost.sum(axis=1)
+    # summing per-charge differences keeps untouched charges from adding rounding noise
+    deltas = (scenario_cost - baseline_cost).sum(axis=1)
+    results = []
+    for s, (name, _) in enumerate(scenarios):
+        delta = float(deltas[s])
+        results.append({
+            "name": name,
+            "cost": float(totals[s]),
+            "delta": delta,
+            "delta_pct": delta / baseline_total * 100 if baseline_total else None,
+            "by_resource": by_resource(scenario_cost[s]),
+            "unknown_sku_ids": unknown[s],
+        })
+    return {
+        "resources": resources.tolist(),
+        "charges": len(sku_ids),
+        "baseline": {"cost": baseline_total, "effective_cost": float(effective_cost.sum()), "by_resource": by_resource(baseline_cost)},
+        "scenarios": results,
+    }
@@ -0,0 +1,209 @@
+import itertools
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import create_engine, make_url, text
+
+from db_utils import database_uri as default_database_uri, is_sqlite_memory
+
+# Read-only question -> SQL tool over the real rate_card/billing_data schema. Generated SQL is
+# turned into a parameterized template keyed by the normalized question, so a repeat question
+# (even with a different resource or SKU) skips generation. Every statement passes a guard that
+# only lets through single, read-only, LIMITed SELECTs that SQLite can answer from an index.
+
+# Flask-SQLAlchemy resolves relative SQLite paths against the app's instance folder
+INSTANCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+ALLOWED_TABLES = {'rate_card', 'billing_data', 'cost_rollup'}
+# column and table names are part of the question's meaning, never placeholders
+SCHEMA_WORDS = ALLOWED_TABLES | {
+    'sku_id', 'service_category', 'service_name', 'service_offering', 'offering_unit', 'pricing_unit', 'pricing_quantity', 'unit_price',
+    'charge_id', 'billing_period_start', 'billing_period_end', 'resource_name', 'resource_type', 'usage_unit', 'usage_quantity', 'effective_cost',
+    'dimension', 'key', 'billing_month', 'charge_count',
+}
+FORBIDDEN = re.compile(r'\b(insert|update|delete|drop|alter|create|replace|attach|detach|pragma|vacuum|reindex|truncate)\b', re.I)
+TABLE_REFERENCE = re.compile(r'\b(?:from|join)\s+["`]?(\w+)', re.I)
+BILLING_DATA_ALIAS = re.compile(r'\bbilling_data\s+(?:as\s+)?["`]?(\w+)', re.I)
+SQL_KEYWORDS = {'where', 'join', 'inner', 'left', 'right', 'cross', 'natural', 'on', 'using', 'group', 'order', 'limit', 'union', 'except', 'intersect', 'window', 'having', 'indexed', 'not'}
+# column LIKE 'prefix%...', with the prefix free of % wildcards and not followed by an ESCAPE clause
+PREFIX_LIKE = re.compile(r"(?<!\.)\b((?:\w+\.)?\w+)\s+like\s+'([^'%]+)(%[^']*)'(?!\s*escape\b)", re.I)
+TRAILING_LIMIT = re.compile(r'\blimit\s+(\d+|:p\d+)\s*$', re.I)
+LITERAL = re.compile(r"'([^']*)'|\"([^\"]*)\"|\b([a-z][a-z0-9]*(?:_[a-z0-9]+)+|sku\d+|\d+(?:\.\d+)?)\b", re.I)
+# literals that may be turned into placeholders per question; more would mean too many key variants
+MAX_LITERALS = 4
+
+class SQLGuardError(Exception):
+    pass
+
+def extract_literals(question):
+    # Returns (normalized text, literals in order of appearance). Literals keep the question's
+    # case since they are bound as-is; only the template key is lowercased.
+    text_ = ' '.join(question.split()).rstrip('?.! ')
+    literals = []
+    for m in LITERAL.finditer(text_):
+        value = next(g for g in m.groups() if g is not None)
+        if value.lower() not in SCHEMA_WORDS and value.lower() not in (literal.lower() for literal in literals):
+            literals.append(value)
+    return text_, literals[:MAX_LITERALS]
+
+def template_key(text_, literals, bound):
+    # lowercased question text with the bound literals replaced by their placeholder
+    for i, value in enumerate(literals):
+        if i in bound:
+            text_ = re.sub(rf"(?<![\w]){re.escape(value)}(?![\w])", f'<p{i}>', text_, flags=re.I)
+    return text_.lower()
+
+def parameterize(sql, literals):
+    # Replaces SQL string literals and bare numbers that equal a question literal with :pN binds.
+    # Only whole tokens are bound: a literal that is a fragment of a SQL string (the 1 in
+    # 'app_1_vm_1') stays in the template, and so in its key, as written.
+    # Returns (template sql, indexes of the literals that were bound).
+    bound = set()
+
+    def replace_string(m):
+        content = m.group(1).replace("''", "'")
+        for i, value in enumerate(literals):
+            if content.lower() == value.lower():
+                bound.add(i)
+                return f':p{i}'
+        return m.group(0)
+
+    def replace_number(m):
+        for i, value in enumerate(literals):
+            if m.group(0) == value:
+                bound.add(i)
+                return f':p{i}'
+        return m.group(0)
+
+    pieces = re.split(r"('(?:[^']|'')*')", sql)
+    for j, piece in enumerate(pieces):
+        if piece.startswith("'"):
+            pieces[j] = re.sub(r"^'((?:[^']|'')*)'$", replace_string, piece)
+        else:
+            pieces[j] = re.sub(r'(?<![\w.:])\d+(?:\.\d+)?(?![\w.])', replace_number, piece)
+    return ''.join(pieces), bound
+
+def bind_params(literals, bound):
+    params = {}
+    for i in bound:
+        value = literals[i]
+        params[f'p{i}'] = float(value) if re.fullmatch(r'\d+\.\d+', value) else int(value) if value.isdigit() else value
+    return params
+
+def prefix_ranges(sql):
+    # SQLite only uses an index for LIKE under case_sensitive_like, so column LIKE 'app_1_%' scans
+    # billing_data. Each prefix LIKE gets an index range on its literal prefix in front of it and
+    # is kept as the exact filter. Names in this schema are lowercase with '_' separators, so the
+    # prefix is taken as written, '_' included.
+    def replace(m):
+        column, prefix, rest = m.groups()
+        # NOT LIKE (where the regex takes NOT for the column) cannot be narrowed to a range
+        if column.lower() == 'not' or re.search(r'\bnot\s*$', sql[:m.start()], re.I):
+            return m.group(0)
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return f"({column} >= '{prefix}' AND {column} < '{upper}' AND {m.group(0)})"
+    return PREFIX_LIKE.sub(replace, sql)
+
+def guard_sql(sql, max_rows):
+    # Returns the statement to run, or raises SQLGuardError
+    sql = sql.strip().rstrip(';').strip()
+    if ';' in re.sub(r"'(?:[^']|'')*'", '', sql):
+        raise SQLGuardError("only a single statement is allowed")
+    if not re.match(r'^(select|with)\b', sql, re.I):
+        raise SQLGuardError("only SELECT statements are allowed")
+    if FORBIDDEN.search(re.sub(r"'(?:[^']|'')*'", '', sql)):
+        raise SQLGuardError("statement is not read-only")
+    tables = {t.lower() for t in TABLE_REFERENCE.findall(sql)}
+    ctes = {c.lower() for c in re.findall(r'\b(\w+)\s+as\s*\(', sql, re.I)}
+    unknown = tables - ALLOWED_TABLES - ctes
+    if unknown:
+        raise SQLGuardError(f"unknown tables {', '.join(sorted(unknown))}")
+    sql = prefix_ranges(sql)
+    limit = TRAILING_LIMIT.search(sql)
+    if not limit or not limit.group(1).isdigit() or int(limit.group(1)) > max_rows:
+        sql = f'SELECT * FROM ({sql}) LIMIT {max_rows}'
+    return sql
+
+def read_only_uri(uri):
+    # The API's database (GPTBMA_DATABASE_URI) opened read-only. Only SQLite files can be opened
+    # that way; other databases rely on guard_sql keeping statements read-only.
+    url = make_url(uri)
+    if url.get_backend_name() != 'sqlite' or is_sqlite_memory(uri):
+        return uri
+    path = url.database
+    if not os.path.isabs(path):
+        path = os.path.join(INSTANCE_PATH, path)
+    return f'sqlite:///file:{path}?mode=ro&uri=true'
+
+def check_plan(conn, sql, params):
+    # SQLite only: billing_data must be read with an index SEARCH. Any SCAN, including one over a
+    # covering index, reads every row, so it is rejected too. The plan names the table by its
+    # alias when the query gives it one.
+    if conn.dialect.name != 'sqlite':
+        return
+    names = {'billing_data'} | {alias.lower() for alias in BILLING_DATA_ALIAS.findall(sql) if alias.lower() not in SQL_KEYWORDS}
+    plan = [row[-1] for row in conn.execute(text(f'EXPLAIN QUERY PLAN {sql}'), params)]
+    scans = [line for line in plan if line.startswith('SCAN ') and line.split()[1].lower() in names]
+    if scans:
+        raise SQLGuardError(f"query would scan all of billing_data ({scans[0]}); filter on resource_name (exact or LIKE 'prefix%'), resource_type, sku_id or the billing period")
+
+class CostQueryTool:
+
+    def __init__(self, generate_sql, database_uri=None, max_rows=100, cache_size=256):
+        # generate_sql: question -> SQL string, typically an LLM chain
+        self.generate_sql = generate_sql
+        self.engine = create_engine(database_uri or os.environ.get('GPTBMA_AGENT_DATABASE_URI') or read_only_uri(default_database_uri()))
+        self.max_rows = max_rows
+        self.cache_size = cache_size
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, text_, literals):
+        # try the most general template first: every literal bound, then fewer
+        with self._lock:
+            for size in range(len(literals), -1, -1):
+                for bound in itertools.combinations(range(len(literals)), size):
+                    key = template_key(text_, literals, set(bound))
+                    entry = self._templates.get(key)
+                    if entry is not None and entry[1] == set(bound):
+                        self._templates.move_to_end(key)
+                        return entry
+        return None
+
+    def store(self, key, sql, bound):
+        with self._lock:
+            self._templates[key] = (sql, bound)
+            self._templates.move_to_end(key)
+            while len(self._templates) > self.cache_size:
+                self._templates.popitem(last=False)
+
+    def query(self, question):
+        # Returns (sql template, params, rows as dicts)
+        text_, literals = extract_literals(question)
+        entry = self.lookup(text_, literals)
+        if entry is not None:
+            self.hits += 1
+            sql, bound = entry
+        else:
+            self.misses += 1
+            sql, bound = parameterize(self.generate_sql(question).strip().rstrip(';'), literals)
+        params = bind_params(literals, bound)
+        guarded = guard_sql(sql, self.max_rows)
+        with self.engine.connect() as conn:
+            check_plan(conn, guarded, params)
+            rows = [dict(row._mapping) for row in conn.execute(text(guarded), params)]
+        # only templates that passed the guard and ran are cached
+        if entry is None:
+            self.store(template_key(text_, literals, bound), sql, bound)
+        sql = guarded
+        return sql, params, rows
+
+    def run(self, question):
+        try:
+            sql, params, rows = self.query(question)
+        except SQLGuardError as e:
+            return f"Query rejected: {e}"
+        return str(rows)
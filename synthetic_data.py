@@ -0,0 +1,192 @@
+import numpy as np
+from datetime import date, datetime, timezone
+
+from db_utils import db, RateCard, RateCardHistory, BillingData, AllocationRule, AllocationTarget, CostAllocation, bump_table_version
+from cache_utils import RATE_CARD_FIELDS
+from rate_history_utils import HISTORY_EPOCH
+
+# Deterministic synthetic rate cards and billing data for load tests and benchmarks.
+# Every resource belongs to an application (app_<n>) and bills a fixed set of SKUs each month.
+
+# (service_category, service_name, service_offering, offering_unit, pricing_unit, pricing_quantity, unit_price)
+SERVICES = [
+    ('compute', 'virtual machine', 'cpu', 'vcpu', 'hour', 1, 0.23),
+    ('compute', 'virtual machine', 'memory', 'gb', 'hour', 1, 0.03),
+    ('compute', 'bare metal', 'cpu', 'vcpu', 'hour', 1, 0.02),
+    ('compute', 'bare metal', 'memory', 'gb', 'hour', 1, 0.13),
+    ('compute', 'container', 'cpu', 'vcpu', 'hour', 1, 0.23),
+    ('compute', 'container', 'memory', 'gb', 'hour', 1, 0.02),
+    ('storage', 'block', 'ssd', 'gb', 'month', 1, 0.10),
+    ('storage', 'object', 'standard', 'gb', 'month', 1, 0.023),
+    ('network', 'egress', 'internet', 'gb', 'month', 1, 0.09),
+    ('observability', 'logs', 'type_1', 'gb', 'day', 1, 0.30),
+    ('observability', 'logs', 'type_2', 'gb', 'day', 1, 0.43),
+    ('observability', 'traces', 'type_1', 'mts', 'day', 10000, 0.33),
+    ('observability', 'metrics', 'type_1', 'mts', 'day', 1000000, 0.33),
+]
+
+# resource type -> indexes into SERVICES it bills, with a typical monthly usage for each
+RESOURCE_TYPES = {
+    'app_vm': [(0, 8 * 730), (1, 32 * 730), (6, 200)],
+    'app_bm': [(2, 64 * 730), (3, 256 * 730), (6, 2000)],
+    'app_container': [(4, 2 * 730), (5, 4 * 730)],
+    'app_storage': [(7, 5000), (8, 800)],
+    'app_logs': [(9, 3000), (10, 500)],
+    'app_traces': [(11, 5e7)],
+    'app_metrics': [(12, 8e8)],
+}
+
+# every PRICE_CHANGE_EVERY months prices drop by PRICE_STEP; the last interval is the current rate card
+PRICE_CHANGE_EVERY = 4
+PRICE_STEP = 0.03
+
+# shared resource types whose cost is allocated onto the application's other resources
+SHARED_TYPES = {'app_logs': 'proportional', 'app_traces': 'even', 'app_metrics': 'fixed'}
+
+def generate_rate_card(variants=1):
+    # variants > 1 adds regional copies of every service with slightly different prices
+    rows = []
+    for v in range(variants):
+        for i, (category, name, offering, offering_unit, pricing_unit, quantity, price) in enumerate(SERVICES):
+            rows.append({
+                'sku_id': f'sku{v * len(SERVICES) + i + 1:03d}',
+                'service_category': category,
+                'service_name': name,
+                'service_offering': offering,
+                'offering_unit': offering_unit,
+                'pricing_unit': pricing_unit,
+                'pricing_quantity': quantity,
+                'unit_price': round(price * (1 + 0.05 * v), 4),
+            })
+    return rows
+
+def billing_periods(n_periods, start_year=2023, start_month=1):
+    periods = []
+    for i in range(n_periods):
+        year, month = divmod(start_month - 1 + i, 12)
+        start = date(start_year + year, month + 1, 1)
+        next_year, next_month = divmod(month + 1, 12)
+        end = date.fromordinal(date(start_year + year + next_year, next_month + 1, 1).toordinal() - 1)
+        periods.append((start, end))
+    return periods
+
+def price_changes_ahead(n_periods):
+    # for each period, how many price changes come after it
+    return (n_periods - 1) // PRICE_CHANGE_EVERY - np.arange(n_periods) // PRICE_CHANGE_EVERY
+
+def historical_price(unit_price, changes_ahead):
+    return round(unit_price * (1 + PRICE_STEP) ** int(changes_ahead), 4)
+
+def generate_rate_card_history(rate_card, n_periods):
+    # effective-dated intervals per SKU matching the prices generate_billing_data charges
+    periods = billing_periods(n_periods)
+    changes = (n_periods - 1) // PRICE_CHANGE_EVERY
+    starts = [HISTORY_EPOCH] + [periods[k * PRICE_CHANGE_EVERY][0] for k in range(1, changes + 1)]
+    rows = []
+    for sku in rate_card:
+        for k, valid_from in enumerate(starts):
+            rows.append({
+                **{field: sku[field] for field in RATE_CARD_FIELDS},
+                'valid_from': valid_from,
+                'valid_to': starts[k + 1] if k < changes else None,
+                'unit_price': historical_price(sku['unit_price'], changes - k),
+            })
+    return rows
+
+def resource_name(resource_index):
+    types = list(RESOURCE_TYPES)
+    resource_type = types[resource_index % len(types)]
+    return f'app_{resource_index // len(types) + 1}_{resource_type[4:]}_{resource_index % 3 + 1}', resource_type
+
+def generate_allocation_rules(n_resources):
+    # One active rule per shared resource of every complete application, splitting it over the
+    # application's other resources; returns (rules, targets) rows with explicit rule ids
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    types = list(RESOURCE_TYPES)
+    rules, targets = [], []
+    for first in range(0, n_resources - len(types) + 1, len(types)):
+        names = {}
+        for r in range(first, first + len(types)):
+            name, resource_type = resource_name(r)
+            names[resource_type] = name
+        consumers = [name for resource_type, name in names.items() if resource_type not in SHARED_TYPES]
+        for resource_type, method in SHARED_TYPES.items():
+            rule_id = len(rules) + 1
+            rules.append({
+                'id': rule_id, 'name': f'{names[resource_type]} {method}', 'source': names[resource_type], 'method': method,
+                'driver': 'effective_cost' if method == 'proportional' else None, 'driver_sku_id': None,
+                'active': True, 'created_at': now, 'updated_at': now,
+            })
+            targets.extend({'rule_id': rule_id, 'consumer': consumer, 'weight': float(len(consumers) - i)} for i, consumer in enumerate(consumers))
+    return rules, targets
+
+def generate_billing_data(n_resources, n_periods, rate_card, seed=0, chunk_size=50000):
+    # Yields lists of charge dicts, chunk_size at a time; usage follows a per-resource trend with noise
+    rng = np.random.default_rng(seed)
+    variants = len(rate_card) // len(SERVICES)
+    periods = billing_periods(n_periods)
+    changes_ahead = price_changes_ahead(n_periods)
+    chunk = []
+    charge_number = 0
+    for r in range(n_resources):
+        name, resource_type = resource_name(r)
+        variant = int(rng.integers(variants))
+        scale = rng.lognormal(0, 0.5)
+        trend = rng.normal(0.01, 0.03)
+        for service, typical_usage in RESOURCE_TYPES[resource_type]:
+            sku = rate_card[variant * len(SERVICES) + service]
+            usage = typical_usage * scale * (1 + trend) ** np.arange(n_periods) * rng.lognormal(0, 0.1, n_periods)
+            prices = np.array([historical_price(sku['unit_price'], ahead) for ahead in changes_ahead])
+            cost = usage / sku['pricing_quantity'] * prices
+            for p, (start, end) in enumerate(periods):
+                charge_number += 1
+                chunk.append({
+                    'charge_id': f'charge{charge_number:09d}',
+                    'sku_id': sku['sku_id'],
+                    'service_offering': sku['service_offering'],
+                    'billing_period_start': start,
+                    'billing_period_end': end,
+                    'resource_name': name,
+                    'resource_type': resource_type,
+                    'usage_unit': sku['offering_unit'],
+                    'usage_quantity': round(float(usage[p]), 3),
+                    'effective_cost': round(float(cost[p]), 2),
+                })
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
+
+def charges_per_resource(resource_index):
+    return len(RESOURCE_TYPES[list(RESOURCE_TYPES)[resource_index % len(RESOURCE_TYPES)]])
+
+def resources_for_rows(n_rows, n_periods):
+    # how many resources produce about n_rows charges over n_periods
+    average = sum(len(skus) for skus in RESOURCE_TYPES.values()) / len(RESOURCE_TYPES)
+    return max(1, round(n_rows / (average * n_periods)))
+
+def load_synthetic_data(n_resources, n_periods, rate_card_variants=1, seed=0, replace=True):
+    # Replaces (or extends) the rate card, its price history and the billing data with synthetic rows,
+    # and on replace the allocation rules too; caller rebuilds rollups and reruns allocations
+    rate_card = generate_rate_card(rate_card_variants)
+    if replace:
+        for model in (BillingData, RateCard, RateCardHistory, CostAllocation, AllocationTarget, AllocationRule):
+            db.session.execute(db.delete(model))
+    db.session.execute(db.insert(RateCard), rate_card)
+    db.session.execute(db.insert(RateCardHistory), generate_rate_card_history(rate_card, n_periods))
+    if replace:
+        rules, targets = generate_allocation_rules(n_resources)
+        if rules:
+            db.session.execute(db.insert(AllocationRule), rules)
+            db.session.execute(db.insert(AllocationTarget), targets)
+        bump_table_version('allocation_rule')
+        bump_table_version('cost_allocation')
+    rows = 0
+    for chunk in generate_billing_data(n_resources, n_periods, rate_card, seed):
+        db.session.execute(db.insert(BillingData), chunk)
+        rows += len(chunk)
+    bump_table_version('rate_card')
+    bump_table_version('billing_data')
+    db.session.commit()
+    return rows
@@ -0,0 +1,42 @@
+from datetime import date
+
+from db_utils import db, BillingData
+from sql_tool import CostQueryTool
+
+def make_tool(generate_sql):
+    # in-memory SQLite keeps one connection per thread, so the table outlives the setup below
+    tool = CostQueryTool(generate_sql, database_uri='sqlite://')
+    BillingData.__table__.create(tool.engine)
+    rows = [
+        {'charge_id': f'charge{i}', 'sku_id': 'sku001', 'service_offering': 'cpu', 'billing_period_start': date(2023, 12, 1), 'billing_period_end': date(2023, 12, 31),
+         'resource_name': resource_name, 'resource_type': 'app_vm', 'usage_unit': 'vcpu', 'usage_quantity': 1.0, 'effective_cost': float(i)}
+        for i, resource_name in enumerate(['app_1_vm_1', 'app_1_vm_1', 'app_1_vm_1', 'app_2_vm_1'])
+    ]
+    with tool.engine.begin() as conn:
+        conn.execute(db.insert(BillingData.__table__), rows)
+    return tool
+
+def test_number_inside_a_string_literal_is_not_bound():
+    questions = []
+
+    def generate_sql(question):
+        questions.append(question)
+        limit = question.split()[1]
+        return f"SELECT charge_id, resource_name FROM billing_data WHERE resource_name = 'app_1_vm_1' ORDER BY effective_cost DESC LIMIT {limit}"
+
+    tool = make_tool(generate_sql)
+    sql, params, rows = tool.query("top 1 charges of app_1_vm_1")
+    assert params == {'p0': 1, 'p1': 'app_1_vm_1'}
+    assert [row['charge_id'] for row in rows] == ['charge2']
+
+    # same template, the limit rebound; app_1_vm_1 must not turn into app_2_vm_1
+    sql, params, rows = tool.query("top 2 charges of app_1_vm_1")
+    assert len(questions) == 1
+    assert params == {'p0': 2, 'p1': 'app_1_vm_1'}
+    assert [row['charge_id'] for row in rows] == ['charge2', 'charge1']
+
+def test_prefix_like_is_answered_from_the_index():
+    tool = make_tool(lambda question: "SELECT resource_name, COUNT(*) AS charges FROM billing_data WHERE resource_name LIKE 'app_1_%' GROUP BY resource_name LIMIT 10")
+    sql, params, rows = tool.query("charges per resource of app_1")
+    assert "resource_name >= 'app_1_'" in sql
+    assert rows == [{'resource_name': 'app_1_vm_1', 'charges': 3}]
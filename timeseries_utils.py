@@ -0,0 +1,84 @@
+import threading
+from collections import Counter
+
+import numpy as np
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+from db_utils import db, CostRollup, fetch_tuples, get_table_version
+from cache_utils import rate_card_cache
+
+# Rollup dimensions that can be laid out as a key x month cost matrix
+MATRIX_DIMENSIONS = ['resource_name', 'resource_type', 'sku_id', 'service_category']
+
+class CostMatrix:
+    # costs[i, j] is the effective_cost of keys[i] in months[j]; months are contiguous and
+    # months without charges hold 0
+
+    def __init__(self, dimension, keys, months, costs):
+        self.dimension = dimension
+        self.keys = keys
+        self.months = months
+        self.costs = costs
+        self.key_index = {key: i for i, key in enumerate(keys)}
+
+def month_number(months):
+    # YYYYMM integers -> consecutive month numbers
+    months = np.asarray(months, dtype=np.int64)
+    return months // 100 * 12 + months % 100 - 1
+
+ROLLUP_CELL = np.dtype([('key', object), ('billing_month', np.int64), ('effective_cost', np.float64)])
+
+def load_cost_matrix(dimension):
+    # Built from the pre-summed cost_rollup rows rather than all charges, read as raw tuples in
+    # one query ordered by key and month. The keys come from the same rows as the cells, so the
+    # matrix is consistent even where each statement reads its own snapshot.
+    rows = fetch_tuples(
+        db.select(CostRollup.key, db.cast(CostRollup.billing_month, db.Integer), CostRollup.effective_cost)
+        .where(CostRollup.dimension == dimension).order_by(CostRollup.key, CostRollup.billing_month)
+    )
+    if not rows:
+        return CostMatrix(dimension, [], [], np.zeros((0, 0)))
+    cells = np.array(rows, dtype=ROLLUP_CELL)
+    # rows arrive grouped by key, so counting them keeps the key order
+    key_counts = Counter(cells['key'].tolist())
+    keys = list(key_counts)
+    month = month_number(cells['billing_month'])
+    first = int(month.min())
+    column = month - first
+    row = np.repeat(np.arange(len(keys)), list(key_counts.values()))
+    matrix = np.zeros((len(keys), int(column.max()) + 1))
+    matrix[row, column] = cells['effective_cost']
+    months = [f'{m // 12:04d}{m % 12 + 1:02d}' for m in range(first, first + matrix.shape[1])]
+    return CostMatrix(dimension, keys, months, matrix)
+
+class CostMatrixCache:
+    # One matrix per dimension, rebuilt when billing_data or the rate card (which moves SKUs
+    # between service categories) changes version
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._matrices = {}
+
+    def get(self, dimension):
+        if dimension not in MATRIX_DIMENSIONS:
+            raise ValueError(f"unknown dimension {dimension}; expected one of {', '.join(MATRIX_DIMENSIONS)}")
+        version = (get_table_version('billing_data')[0], rate_card_cache.version)
+        cached = self._matrices.get(dimension)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        with self._lock:
+            cached = self._matrices.get(dimension)
+            if cached is None or cached[0] != version:
+                cached = self._matrices[dimension] = (version, load_cost_matrix(dimension))
+            return cached[1]
+
+def get_cost_matrix_cache():
+    # one cache per app, in app.extensions like the rate card cache
+    cache = current_app.extensions.get('cost_matrix_cache')
+    if cache is None:
+        cache = current_app.extensions.setdefault('cost_matrix_cache', CostMatrixCache())
+    return cache
+
+# the current app's CostMatrixCache
+cost_matrix_cache = LocalProxy(get_cost_matrix_cache)
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from api_client import billing_api
+
+# Memoizes billing tool results per (tool name, normalized arguments). Entries are LRU-bounded,
+# expire after ttl seconds, and are dropped as soon as the backend reports a newer version of a
+# table they were computed from. Versions are polled at most every version_check_interval seconds.
+# Concurrent calls with the same key (sync or async, from any thread) share a single backend call.
+
+VERSIONS_KEY = ('/api/versions', '')
+
+def normalize(value):
+    # equal questions must produce equal keys: sorted dict keys (see cache_key), floats for numbers
+    if isinstance(value, dict):
+        return {str(k): normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    return str(value)
+
+def cache_key(tool_name, args):
+    return tool_name, json.dumps(normalize(args), sort_keys=True)
+
+class ToolResultCache:
+
+    def __init__(self, maxsize=256, ttl=300.0, version_check_interval=5.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._versions_checked_at = None
+        # key -> Future of the backend call in flight for it
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, versions, result = entry
+            if expires_at < time.monotonic() or any(self._versions.get(t) != v for t, v in versions.items()):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def _store(self, key, depends_on, result):
+        with self._lock:
+            self.misses += 1
+            versions = {t: self._versions.get(t) for t in depends_on}
+            self._entries[key] = (time.monotonic() + self.ttl, versions, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _versions_due(self):
+        checked_at = self._versions_checked_at
+        return checked_at is None or time.monotonic() - checked_at >= self.version_check_interval
+
+    def _set_versions(self, versions):
+        with self._lock:
+            self._versions = versions
+            self._versions_checked_at = time.monotonic()
+
+    def _join(self, key):
+        # Returns (future, leader). The leader makes the backend call and resolves the future;
+        # everyone else asking for the same key meanwhile waits on it.
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                if key != VERSIONS_KEY:
+                    self.hits += 1
+                return future, False
+            future = self._inflight[key] = Future()
+            return future, True
+
+    def _resolve(self, key, future, result=None, error=None):
+        with self._lock:
+            del self._inflight[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _once(self, key, compute, save):
+        # save runs while the key is still in flight, so no caller misses both the future and the entry
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = compute()
+            save(result)
+        except BaseException as e:
+            self._resolve(key, future, error=e)
+            raise
+        self._resolve(key, future, result)
+        return result
+
+    async def _aonce(self, key, compute, save):
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await compute()
+            save(result)
+        except BaseException as e:
+            self._resolve(key, future, error=e)
+            raise
+        self._resolve(key, future, result)
+        return result
+
+    def call(self, tool_name, args, depends_on, fn):
+        # depends_on: backend tables ('rate_card', 'billing_data') the result is derived from
+        if self._versions_due():
+            self._once(VERSIONS_KEY, lambda: billing_api.get('/api/versions'), self._set_versions)
+        key = cache_key(tool_name, args)
+        entry = self._lookup(key)
+        if entry is not None:
+            return entry[2]
+        return self._once(key, lambda: fn(**args), lambda result: self._store(key, depends_on, result))
+
+    async def acall(self, tool_name, args, depends_on, fn):
+        if self._versions_due():
+            await self._aonce(VERSIONS_KEY, lambda: billing_api.aget('/api/versions'), self._set_versions)
+        key = cache_key(tool_name, args)
+        entry = self._lookup(key)
+        if entry is not None:
+            return entry[2]
+        return await self._aonce(key, lambda: fn(**args), lambda result: self._store(key, depends_on, result))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions_checked_at = None
+
+tool_cache = ToolResultCache()